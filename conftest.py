@@ -1,4 +1,5 @@
 import glob
+import json
 import logging
 import shutil
 import os
@@ -10,6 +11,8 @@ import pytest
 import yaml
 
 from contrib.namespaces import LinuxNamespace
+from pydnstest import scenario_cache
+from pydnstest.scenario import str2bool
 
 Scenario = namedtuple("Scenario", ["path", "qmin", "config"])
 
@@ -36,6 +39,14 @@ def config_sanity_check(config_dict, config_name):
                     f"({cfg['name']}, {config_name})"
                 )
 
+        names = {program['name'] for program in config_dict['programs']}
+        unknown = set(cfg.get("depends_on", [])) - names
+        assert not unknown, f"Program {cfg['name']} depends on unknown programs: {unknown}"
+
+        for argument in cfg.get("reset", []):
+            assert isinstance(argument, str), \
+                f"All reset arguments in yaml should be strings. ({cfg['name']}, {config_name})"
+
 
 def get_qmin_config(path):
     """Reads configuration from the *.rpl file and determines query-minimization setting."""
@@ -50,6 +61,17 @@ def get_qmin_config(path):
     return None
 
 
+def get_config_text(path):
+    """Reads configuration block from the *.rpl file."""
+    lines = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if re.search(r"^CONFIG_END", line) or re.search(r"^SCENARIO_BEGIN", line):
+                break
+            lines.append(line)
+    return ''.join(lines)
+
+
 def check_jemalloc_link(config_dict):
     # pylint: disable=no-member
     for program in config_dict['programs']:
@@ -142,12 +164,56 @@ def pytest_generate_tests(metafunc):
         metafunc.parametrize("max_retries", [max_retries], ids=lambda id: "max-retries-"+str(id))
 
 
+def pytest_configure(config):
+    if getattr(config.option, "forked", False) and str2bool(os.environ.get("DECKARD_WARM", "no")):
+        raise pytest.UsageError("DECKARD_WARM keeps daemons running between tests "
+                                "and cannot be used with --forked")
+
+
+def warm_group(item):
+    """Returns key of tests which generate the same configuration for binaries under test."""
+    callspec = getattr(item, 'callspec', None)
+    if callspec is None or 'scenario' not in callspec.params:
+        return ('', '', '')
+    scenario = callspec.params['scenario']
+    return (json.dumps(scenario.config, sort_keys=True), item.originalname,
+            get_config_text(scenario.path))
+
+
 def pytest_collection_modifyitems(items):
     """We automatically mark test that need faking monotonic time and run them separately."""
     for item in items:
         if "monotonic" in item.nodeid:
             item.add_marker(pytest.mark.monotonic)
+    # Daemons are kept running only between consecutive tests with the same configuration
+    if str2bool(os.environ.get("DECKARD_WARM", "false")):
+        items.sort(key=warm_group)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):  # pylint: disable=unused-argument
+    """Parse the scenario in the worker process before the test is forked.
+
+    Tests run with --forked would otherwise parse the same file over and over again
+    (once per qmin variant and --config). Parsed scenarios are cached in the worker
+    and inherited by forked children."""
+    callspec = getattr(item, 'callspec', None)
+    if callspec is not None and 'scenario' in callspec.params:
+        try:
+            scenario_cache.parse_file_cached(os.path.realpath(callspec.params['scenario'].path))
+        except Exception:  # pylint: disable=broad-except
+            pass  # the test itself will parse the file again and report the error
+    yield
+
+
+# PID of the process which already entered its own user namespace
+NAMESPACE_PID = None
 
 
 def pytest_runtest_setup(item):  # pylint: disable=unused-argument
-    LinuxNamespace("user").__enter__()  # pylint: disable=unnecessary-dunder-call
+    # User namespaces nest at most 32 levels deep, enter one per process
+    # (i.e. per test with --forked, once per session with DECKARD_WARM or unit tests)
+    global NAMESPACE_PID  # pylint: disable=global-statement
+    if NAMESPACE_PID != os.getpid():
+        LinuxNamespace("user").__enter__()  # pylint: disable=unnecessary-dunder-call
+        NAMESPACE_PID = os.getpid()
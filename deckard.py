@@ -1,25 +1,47 @@
 #!/usr/bin/env python3
+import asyncio
+import atexit
+import collections
+import concurrent.futures
+import contextlib
 import errno
+import functools
+import hashlib
+import json
 import logging
 import logging.config
 import os
+import selectors
 import shlex
 import shutil
 import socket
+import struct
 import subprocess
-import sys
+import tempfile
 import time
 from datetime import datetime
-from typing import Set  # noqa
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple  # noqa
 
 import jinja2
+import jinja2.meta
 
-from pydnstest import scenario, testserver
+from pydnstest import loadgen, scenario, scenario_cache, supervisor, testserver
 
 # path to Deckard files
 INSTALLDIR = os.path.dirname(os.path.abspath(__file__))
 # relative to working directory
 TRUST_ANCHOR_SUBDIR = 'ta'
+# number of client source addresses used by QUERY_BATCH steps
+BATCH_CLIENT_ADDRESSES = 4
+# seconds to wait for reset command of a daemon kept running between scenarios
+RESET_TIMEOUT = 10
+# number of rendered templates remembered by render_template()
+RENDER_CACHE_SIZE = 256
+# seconds to wait until a daemon is ready
+CONNCHECK_TIMEOUT = 5
+# seconds between lookups of listening socket of a starting daemon
+CONNCHECK_INTERVAL = 0.05
+TCP_LISTEN = '0A'  # socket state in /proc/net/tcp
 
 
 class DeckardUnderLoadError(Exception):
@@ -47,20 +69,34 @@ def setup_faketime(context):
     """
     # Set up libfaketime
     os.environ["FAKETIME_NO_CACHE"] = "1"
-    os.environ["FAKETIME_TIMESTAMP_FILE"] = os.path.join(context["tmpdir"], ".time")
+    # Daemons kept running between scenarios keep reading the same file
+    time_dir = WARM_DAEMONS.get_root() if WARM_DAEMONS.enabled else context["tmpdir"]
+    os.environ["FAKETIME_TIMESTAMP_FILE"] = os.path.join(time_dir, ".time")
     os.unsetenv("FAKETIME")
 
     write_timestamp_file(os.environ["FAKETIME_TIMESTAMP_FILE"],
                          context.get('_OVERRIDE_TIMESTAMP', time.time()))
 
 
-def setup_daemon_environment(program_config, context):
-    program_config["WORKING_DIR"] = os.path.join(context["tmpdir"], program_config["name"])
+def setup_daemon_environment(program_config, context, root=None):
+    """Set template variables of the program and create its working directory in root"""
+    set_daemon_variables(program_config, context, root)
     os.mkdir(program_config['WORKING_DIR'])
+    create_trust_anchor_files(context["TRUST_ANCHOR_FILES"], program_config['WORKING_DIR'])
+
+
+def set_daemon_variables(program_config, context, root=None):
+    program_config["WORKING_DIR"] = os.path.join(root or context["tmpdir"],
+                                                 program_config["name"])
     program_config["DAEMON_NAME"] = program_config["name"]
     program_config['SELF_ADDR'] = program_config['address']
-    program_config['TRUST_ANCHOR_FILES'] = create_trust_anchor_files(
-        context["TRUST_ANCHOR_FILES"], program_config['WORKING_DIR'])
+    program_config['TRUST_ANCHOR_FILES'] = [
+        trust_anchor_path(program_config['WORKING_DIR'], domain)
+        for domain in context["TRUST_ANCHOR_FILES"]]
+
+
+def trust_anchor_path(work_dir, domain):
+    return os.path.realpath(os.path.join(work_dir, TRUST_ANCHOR_SUBDIR, f'{domain}.key'))
 
 
 def create_trust_anchor_files(ta_files, work_dir):
@@ -74,9 +110,7 @@ def create_trust_anchor_files(ta_files, work_dir):
     """
     full_paths = []
     for domain, ta_lines in ta_files.items():
-        file_name = f'{domain}.key'
-        full_path = os.path.realpath(
-            os.path.join(work_dir, TRUST_ANCHOR_SUBDIR, file_name))
+        full_path = trust_anchor_path(work_dir, domain)
         full_paths.append(full_path)
         dir_path = os.path.dirname(full_path)
         try:
@@ -91,26 +125,90 @@ def create_trust_anchor_files(ta_files, work_dir):
 
 def generate_from_templates(program_config, context):
     """Generate configuration for the program"""
-    template_ctx = context.copy()
-    template_ctx.update(program_config)
+    write_configs(program_config, render_templates(program_config, context))
+
 
+def render_templates(program_config, context) -> List[Tuple[str, str]]:
+    """Return list of (config name, rendered config) for the program"""
     # public mapping program name -> program vars
-    template_ctx['PROGRAMS'] = {}
-    for cfg in template_ctx['programs']:
-        template_ctx['PROGRAMS'][cfg['name']] = cfg
+    programs = {cfg['name']: cfg for cfg in context['programs']}
+    template_ctx = collections.ChainMap({'PROGRAMS': programs}, program_config, context)
 
-    j2template_loader = jinja2.FileSystemLoader(searchpath=os.getcwd())
-    j2template_env = jinja2.Environment(loader=j2template_loader)
+    return [(config_name, render_template(template_name, template_ctx))
+            for template_name, config_name in zip(program_config['templates'],
+                                                  program_config['configs'])]
 
-    for template_name, config_name in zip(template_ctx['templates'], template_ctx['configs']):
-        j2template = j2template_env.get_template(template_name)
-        cfg_rendered = j2template.render(template_ctx)
-        config_path = os.path.join(template_ctx['WORKING_DIR'], config_name)
+
+@functools.lru_cache(maxsize=None)
+def template_environment(searchpath: str) -> jinja2.Environment:
+    """Return environment shared by all tests, compiled templates are cached on disk"""
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=searchpath),
+                              bytecode_cache=jinja2.FileSystemBytecodeCache())
+
+
+@functools.lru_cache(maxsize=None)
+def template_variables(searchpath: str, template_name: str) -> Optional[FrozenSet[str]]:
+    """
+    Return names of variables used by the template and templates it includes.
+
+    None is returned if name of an included template is computed, so it is not known.
+    """
+    env = template_environment(searchpath)
+    variables = set()  # type: Set[str]
+    seen = set()  # type: Set[str]
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        ast = env.parse(env.loader.get_source(env, name)[0])  # type: ignore
+        variables |= jinja2.meta.find_undeclared_variables(ast)
+        for referenced in jinja2.meta.find_referenced_templates(ast):
+            if referenced is None:
+                return None
+            pending.append(referenced)
+    return frozenset(variables)
+
+
+RENDERED_TEMPLATES = collections.OrderedDict()  # type: collections.OrderedDict[str, str]
+
+
+def render_template(template_name, template_ctx) -> str:
+    """
+    Render template with variables from template_ctx.
+
+    Templates rendered with the same values of variables they use are rendered only once,
+    e.g. configurations of scenarios without trust anchors differ only in qmin setting.
+    """
+    searchpath = os.getcwd()
+    names = template_variables(searchpath, template_name)
+    if names is None:
+        variables = dict(template_ctx)
+    else:
+        variables = {name: template_ctx[name] for name in names if name in template_ctx}
+    key = hashlib.sha256(json.dumps([searchpath, template_name, variables],
+                                    sort_keys=True, default=repr).encode()).hexdigest()
+    try:
+        RENDERED_TEMPLATES.move_to_end(key)
+        return RENDERED_TEMPLATES[key]
+    except KeyError:
+        pass
+    rendered = template_environment(searchpath).get_template(template_name).render(variables)
+    RENDERED_TEMPLATES[key] = rendered
+    if len(RENDERED_TEMPLATES) > RENDER_CACHE_SIZE:
+        RENDERED_TEMPLATES.popitem(last=False)
+    return rendered
+
+
+def write_configs(program_config, configs):
+    for config_name, cfg_rendered in configs:
+        config_path = os.path.join(program_config['WORKING_DIR'], config_name)
         with open(config_path, 'w', encoding='utf-8') as output:
             output.write(cfg_rendered)
 
 
-def run_daemon(program_config):
+def run_daemon(program_config, env=None):
     """Start binary and return its process object"""
     name = program_config['DAEMON_NAME']
     proc = None
@@ -125,7 +223,8 @@ def run_daemon(program_config):
         try:
             # pylint: disable=consider-using-with
             proc = subprocess.Popen(program_config['args'], stdout=daemon_log_file,
-                                    stderr=subprocess.STDOUT, cwd=program_config['WORKING_DIR'])
+                                    stderr=subprocess.STDOUT, cwd=program_config['WORKING_DIR'],
+                                    env=env)
         except subprocess.CalledProcessError:
             logger = logging.getLogger(f'deckard.daemon_log.{name}')
             logger.exception("Can't start '%s'", program_config['args'])
@@ -142,11 +241,78 @@ def log_fatal_daemon_error(cfg, msg):
         logger.error(logfile.read())
 
 
-def conncheck_daemon(process, cfg, sockfamily):
-    """Wait until the server accepts TCP clients"""
-    sock = socket.socket(sockfamily, socket.SOCK_STREAM)
-    deadline = time.monotonic() + 5
-    with sock:
+def notify_socket(cfg):
+    """Return socket receiving sd_notify() messages and its address for NOTIFY_SOCKET"""
+    # Abstract socket, it belongs to network namespace of the test
+    name = f'deckard/{os.getpid()}/{cfg["name"]}/{os.urandom(4).hex()}'
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(f'\0{name}')
+    sock.setblocking(False)
+    return sock, f'@{name}'
+
+
+def notified_ready(sock, cfg) -> bool:
+    """Read pending sd_notify() messages, return True if the daemon reported READY=1"""
+    logger = logging.getLogger(f'deckard.daemon.{cfg["name"]}.notify')
+    ready = False
+    while True:
+        try:
+            message = sock.recv(4096)
+        except BlockingIOError:
+            return ready
+        for line in message.decode(errors='replace').splitlines():
+            logger.debug('%s', line)
+            ready = ready or line == 'READY=1'
+
+
+def proc_net_address(address, sockfamily) -> str:
+    """Return address in format used by /proc/net/tcp, i.e. 32-bit words in host order"""
+    packed = socket.inet_pton(sockfamily, address)
+    return ''.join(f'{word:08X}' for word in struct.unpack(f'={len(packed) // 4}I', packed))
+
+
+def listening(address, sockfamily, port=53) -> bool:
+    """
+    Check there is a TCP socket listening on the address or on the wildcard address.
+
+    IPv4 address is also served by dual-stack IPv6 sockets listening on :: or on
+    IPv4-mapped address ::ffff:a.b.c.d.
+    """
+    if sockfamily == socket.AF_INET6:
+        tables = {'/proc/net/tcp6': [(address, socket.AF_INET6), ('::', socket.AF_INET6)]}
+    else:
+        tables = {'/proc/net/tcp': [(address, socket.AF_INET), ('0.0.0.0', socket.AF_INET)],
+                  '/proc/net/tcp6': [(f'::ffff:{address}', socket.AF_INET6),
+                                     ('::', socket.AF_INET6)]}
+    for path, addresses in tables.items():
+        local = {f'{proc_net_address(addr, family)}:{port:04X}' for addr, family in addresses}
+        try:
+            with open(path, encoding='ascii') as sockets:
+                next(sockets)  # header
+                for line in sockets:
+                    fields = line.split()
+                    if fields[3] == TCP_LISTEN and fields[1] in local:
+                        return True
+        except FileNotFoundError:  # IPv6 disabled
+            continue
+    return False
+
+
+def conncheck_daemon(process, cfg, sockfamily, notify_sock=None):
+    """
+    Wait until the server listens on TCP port 53, or reports READY=1 if notify_sock is given.
+
+    Death of the process is signalled by its pidfd and readiness by the notify socket,
+    so the wait sleeps in select(); listening socket is looked up every CONNCHECK_INTERVAL.
+    """
+    deadline = time.monotonic() + CONNCHECK_TIMEOUT
+    with selectors.DefaultSelector() as selector, contextlib.ExitStack() as stack:
+        pidfd = supervisor.pidfd_open(process.pid)
+        if pidfd is not None:
+            stack.callback(os.close, pidfd)
+            selector.register(pidfd, selectors.EVENT_READ)
+        if notify_sock is not None:
+            selector.register(notify_sock, selectors.EVENT_READ)
         while True:
             # Check if the process is running
             ecode = process.poll()
@@ -154,57 +320,267 @@ def conncheck_daemon(process, cfg, sockfamily):
                 msg = f'process died, exit code {ecode}'
                 log_fatal_daemon_error(cfg, msg)
                 raise subprocess.CalledProcessError(process.returncode, cfg['args'], msg)
-            try:
-                sock.connect((cfg['address'], 53))
+            if notify_sock is not None:
+                if notified_ready(notify_sock, cfg):
+                    return  # success
+            elif listening(cfg['address'], sockfamily):
                 return  # success
-            except socket.error as ex:
-                if time.monotonic() > deadline:
-                    msg = 'server does not accept connections on TCP port 53'
-                    log_fatal_daemon_error(cfg, msg)
-                    raise DeckardUnderLoadError(msg) from ex
 
-            if sys.version_info < (3, 11):
-                time.sleep(0.1)
-            else:
-                # FIXME: sleep() won't work anymore until faketime > 0.9.10
-                # https://github.com/wolfcw/libfaketime/issues/426
-                # This is perhaps a bit CPU-wasteful here, but it works:
-                os.sched_yield()
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                if notify_sock is not None:
+                    msg = 'server did not report readiness (READY=1) over NOTIFY_SOCKET'
+                else:
+                    msg = 'server does not accept connections on TCP port 53'
+                log_fatal_daemon_error(cfg, msg)
+                raise DeckardUnderLoadError(msg)
+            if notify_sock is None or pidfd is None:
+                timeout = min(timeout, CONNCHECK_INTERVAL)
+            selector.select(timeout)
 
 
 def setup_daemons(context):
     """Configure daemons and start them"""
-    # Setup daemon environment
-    daemons = []
+    if WARM_DAEMONS.enabled:
+        return setup_warm_daemons(context)
 
+    # Setup daemon environment, templates can refer to variables of all programs
     for program_config in context['programs']:
         setup_daemon_environment(program_config, context)
+    for program_config in context['programs']:
         generate_from_templates(program_config, context)
+    return start_daemons(context)
 
-        daemon_proc = run_daemon(program_config)
-        daemons.append({'proc': daemon_proc, 'cfg': program_config})
-        if program_config.get('conncheck', True):
-            try:
-                conncheck_daemon(daemon_proc, program_config, context['_SOCKET_FAMILY'])
-            except:  # noqa  -- bare except might be valid here?
-                daemon_proc.terminate()
-                raise
 
+def setup_warm_daemons(context):
+    """Reuse daemons from the previous scenario if their configuration is the same"""
+    root = WARM_DAEMONS.get_root()
+    for program_config in context['programs']:
+        set_daemon_variables(program_config, context, root)
+    rendered = [render_templates(program_config, context)
+                for program_config in context['programs']]
+    key = daemons_key(context, rendered)
+    if WARM_DAEMONS.reuse(key):
+        return WARM_DAEMONS.daemons
+
+    WARM_DAEMONS.stop()
+    for program_config, configs in zip(context['programs'], rendered):
+        shutil.rmtree(os.path.join(root, program_config['name']), ignore_errors=True)
+        setup_daemon_environment(program_config, context, root)
+        write_configs(program_config, configs)
+    daemons = start_daemons(context)
+    WARM_DAEMONS.keep(key, daemons)
     return daemons
 
 
+def daemons_key(context, rendered) -> str:
+    """Return hash of everything the daemons are started with"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([os.environ.get('DECKARD_WRAPPER', ''),
+                              context['TRUST_ANCHOR_FILES']], sort_keys=True).encode())
+    for program_config, configs in zip(context['programs'], rendered):
+        digest.update(json.dumps([program_config['name'], program_config['binary'],
+                                  program_config['additional'], configs]).encode())
+    return digest.hexdigest()
+
+
+def start_order(programs):
+    """Return programs sorted so that each follows programs listed in its depends_on"""
+    by_name = {cfg['name']: cfg for cfg in programs}
+    ordered = []  # type: List[dict]
+    visiting = set()  # type: Set[str]
+
+    def visit(cfg):
+        if any(cfg is done for done in ordered):
+            return
+        if cfg['name'] in visiting:
+            raise ValueError(f'programs depend on each other: {cfg["name"]}')
+        visiting.add(cfg['name'])
+        for dependency in cfg.get('depends_on', []):
+            if dependency not in by_name:
+                raise ValueError(f'program {cfg["name"]} depends on unknown program '
+                                 f'{dependency}')
+            visit(by_name[dependency])
+        ordered.append(cfg)
+
+    for cfg in programs:
+        visit(cfg)
+    return ordered
+
+
+def start_daemons(context):
+    """
+    Start all daemons concurrently and wait until they accept connections.
+
+    Daemon is started only after programs listed in its depends_on accept connections.
+    """
+    programs = start_order(context['programs'])
+    futures = {}  # type: Dict[str, concurrent.futures.Future]
+    started = []  # type: List[dict]
+
+    def start(program_config):
+        for dependency in program_config.get('depends_on', []):
+            futures[dependency].result()
+        with contextlib.ExitStack() as stack:
+            env = None
+            notify_sock = None
+            if program_config.get('notify', False):
+                notify_sock, notify_address = notify_socket(program_config)
+                stack.enter_context(notify_sock)
+                env = dict(os.environ, NOTIFY_SOCKET=notify_address)
+            daemon_proc = run_daemon(program_config, env)
+            daemon = {'proc': daemon_proc, 'cfg': program_config}
+            started.append(daemon)
+            if program_config.get('conncheck', True):
+                conncheck_daemon(daemon_proc, program_config, context['_SOCKET_FAMILY'],
+                                 notify_sock)
+        return daemon
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(programs)) as executor:
+        for program_config in programs:
+            futures[program_config['name']] = executor.submit(start, program_config)
+        try:
+            return [futures[cfg['name']].result() for cfg in context['programs']]
+        except:  # noqa  -- bare except might be valid here?
+            concurrent.futures.wait(futures.values())
+            supervisor.terminate(started)
+            raise
+
+
+def stop_daemons(daemons):
+    """Terminate daemons and raise exception if any of them failed"""
+    supervisor.terminate(daemons)
+    for daemon in daemons:
+        logging.getLogger('deckard.daemon').debug('%s', supervisor.describe_exit(daemon))
+        daemon_logger_log = logging.getLogger(f'deckard.daemon_log.{daemon["cfg"]["name"]}')
+        with open(daemon['cfg']['log'], encoding='utf-8') as logf:
+            for line in logf:
+                daemon_logger_log.debug(line.strip())
+        ignore_exit = daemon["cfg"].get('ignore_exit_code', False)
+        if daemon['proc'].returncode != 0 and not ignore_exit:
+            raise ValueError(supervisor.describe_exit(daemon))
+
+
+def reset_daemon(daemon) -> bool:
+    """Run reset command of the daemon, return False if it is missing or failed"""
+    cfg = daemon['cfg']
+    if not cfg.get('reset'):
+        return False
+    logger = logging.getLogger(f'deckard.daemon.{cfg["name"]}.reset')
+    try:
+        result = subprocess.run(cfg['reset'], cwd=cfg['WORKING_DIR'], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=RESET_TIMEOUT, check=False,
+                                env=dict(os.environ, DECKARD_DAEMON_PID=str(daemon['proc'].pid)))
+    except (OSError, subprocess.TimeoutExpired) as ex:
+        logger.warning('reset failed, starting the daemon again: %s', ex)
+        return False
+    if result.returncode != 0:
+        logger.warning('reset failed with exit code %d, starting the daemon again: %s',
+                       result.returncode, result.stdout.decode(errors='replace'))
+        return False
+    return True
+
+
+def check_warm_daemons(daemons, context):
+    """
+    Check daemons kept running survived the scenario.
+
+    Daemon log written during the scenario is copied into working directory of the scenario.
+    """
+    for daemon in daemons:
+        name = daemon['cfg']['name']
+        daemon_logger_log = logging.getLogger(f'deckard.daemon_log.{name}')
+        os.makedirs(os.path.join(context["tmpdir"], name), exist_ok=True)
+        with open(daemon['cfg']['log'], encoding='utf-8') as logf, \
+                open(os.path.join(context["tmpdir"], name, 'server.log'), 'w',
+                     encoding='utf-8') as test_logf:
+            logf.seek(daemon.get('log_offset', 0))
+            for line in logf:
+                test_logf.write(line)
+                daemon_logger_log.debug(line.strip())
+            daemon['log_offset'] = logf.tell()
+    for daemon in daemons:
+        if daemon['proc'].poll() is not None:
+            WARM_DAEMONS.stop()
+            raise ValueError(supervisor.describe_exit(daemon))
+
+
+class WarmDaemons:
+    """
+    Daemons kept running between scenarios with the same configuration (DECKARD_WARM).
+
+    All scenarios in the process share one working directory and daemon addresses, so only
+    daemons of the last configuration are kept. Before the next scenario their state is reset
+    by 'reset' command from the program configuration, daemons without it are started again.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.key = None
+        self.daemons = []
+
+    @property
+    def enabled(self) -> bool:
+        return scenario.str2bool(os.environ.get('DECKARD_WARM', 'false'))
+
+    def get_root(self) -> str:
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix='tmpdeckardwarm')
+            atexit.register(self.cleanup)
+        return self.root
+
+    def reuse(self, key) -> bool:
+        """Return True if running daemons have the configuration and their state was reset"""
+        if key != self.key or not self.daemons:
+            return False
+        return all(daemon['proc'].poll() is None and reset_daemon(daemon)
+                   for daemon in self.daemons)
+
+    def keep(self, key, daemons):
+        self.key = key
+        self.daemons = daemons
+
+    def stop(self):
+        daemons, self.daemons, self.key = self.daemons, [], None
+        try:
+            stop_daemons(daemons)
+        except ValueError as ex:
+            logging.getLogger('deckard.daemon').warning('%s', ex)
+
+    def cleanup(self):
+        self.stop()
+        if "DECKARD_NOCLEAN" not in os.environ:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+WARM_DAEMONS = WarmDaemons()
+
+
 def check_for_reply_steps(case: scenario.Scenario) -> bool:
     return any(s.type == "REPLY" for s in case.steps)
 
 
 def run_testcase(case, daemons, context, prog_under_test_ip):
     """Run actual test and raise exception if the test failed"""
+    load = 'DECKARD_LOAD_QPS' in os.environ or 'DECKARD_LOAD_TRACE' in os.environ
     server = testserver.TestServer(case, context["_SOCKET_FAMILY"],
-                                   context["DECKARD_IP"], context["if_manager"])
+                                   context["DECKARD_IP"], context["if_manager"],
+                                   workers=int(os.environ.get('DECKARD_SERVER_WORKERS', '1')))
+    case.keep_tcp = scenario.str2bool(os.environ.get('DECKARD_KEEP_TCP', 'false'))
+    if any(step.type.startswith('QUERY_BATCH') for step in case.steps):
+        case.client_addresses = [context["DECKARD_IP"]] + [
+            context["if_manager"].assign_internal_address(context["_SOCKET_FAMILY"])
+            for _ in range(BATCH_CLIENT_ADDRESSES - 1)]
     server.start()
 
     try:
-        server.play(prog_under_test_ip)
+        if load:
+            run_load(case, context, prog_under_test_ip)
+        else:
+            # Stop playing as soon as any daemon dies instead of waiting for answers from it
+            with supervisor.Supervisor(
+                    daemons, lambda daemon: case.abort(supervisor.describe_exit(daemon))):
+                server.play(prog_under_test_ip)
     finally:
         server.stop()
 
@@ -212,30 +588,59 @@ def run_testcase(case, daemons, context, prog_under_test_ip):
             logging.warning("%s has REPLY steps in it. These are known to fail randomly. "
                             "Errors might be false positives.", case.file)
 
-        for daemon in daemons:
-            daemon['proc'].terminate()
-            daemon['proc'].wait()
-            daemon_logger_log = logging.getLogger(f'deckard.daemon_log.{daemon["cfg"]["name"]}')
-            with open(daemon['cfg']['log'], encoding='utf-8') as logf:
-                for line in logf:
-                    daemon_logger_log.debug(line.strip())
-            ignore_exit = daemon["cfg"].get('ignore_exit_code', False)
-            if daemon['proc'].returncode != 0 and not ignore_exit:
-                raise ValueError(f"process {daemon['cfg']['name']} terminated "
-                                 f"with return code {daemon['proc'].returncode}")
-
-    if server.undefined_answers > 0:
+        if WARM_DAEMONS.enabled:
+            check_warm_daemons(daemons, context)
+        else:
+            stop_daemons(daemons)
+
+    # SERVFAILs for undefined answers are part of the load report
+    if server.undefined_answers > 0 and not load:
         raise ValueError('the scenario does not define all necessary answers (see error log)')
 
 
+def run_load(case, context, prog_under_test_ip):
+    """
+    Replay client queries against the binary under test instead of playing scenario steps.
+
+    Queries are read from DECKARD_LOAD_TRACE file (PCAP or text) or taken from QUERY steps
+    of the scenario, and sent with constant rate DECKARD_LOAD_QPS for DECKARD_LOAD_DURATION
+    seconds, or with original timing of the trace sped up by DECKARD_LOAD_SPEEDUP.
+    Report is logged and stored into load.json in the working directory.
+    """
+    if 'DECKARD_LOAD_TRACE' in os.environ:
+        trace = loadgen.read_trace(os.environ['DECKARD_LOAD_TRACE'])
+        queries = [query for _, query in trace]
+    else:
+        queries = loadgen.queries_from_scenario(case)
+    if 'DECKARD_LOAD_QPS' in os.environ:
+        schedule = loadgen.rate_schedule(
+            queries, float(os.environ['DECKARD_LOAD_QPS']),
+            float(os.environ.get('DECKARD_LOAD_DURATION', loadgen.DEFAULT_DURATION)))
+    else:
+        schedule = loadgen.trace_schedule(trace, float(os.environ.get('DECKARD_LOAD_SPEEDUP', 1)))
+
+    # Simulated servers answer from ranges eligible for the first QUERY step
+    case.set_current_step(next((i for i, step in enumerate(case.steps) if step.type == 'QUERY'),
+                               0))
+    report = asyncio.run(loadgen.replay(prog_under_test_ip, 53, schedule,
+                                        src_address=context["DECKARD_IP"]))
+    logging.getLogger('deckard.load').info('%s: %s', case.file, report)
+    with open(os.path.join(context["tmpdir"], 'load.json'), 'w', encoding='utf-8') as report_file:
+        json.dump(report.summary(), report_file, indent=2)
+
+
 def process_file(path, qmin, config):
-    """Parse scenario from a file object and create workdir."""
+    """
+    Parse scenario from a file object, create workdir and run the test.
+
+    Returns timing recorded while playing the scenario, see pydnstest.timing.
+    """
 
     # Preserve original configuration
     context = config.copy()
 
-    # Parse scenario
-    case, case_config_text = scenario.parse_file(os.path.realpath(path))
+    # Parse scenario, reusing result from previous runs of the same file in this process
+    case, case_config_text = scenario_cache.parse_file_cached(os.path.realpath(path))
     case_config = scenario.parse_config(case_config_text, qmin, INSTALLDIR)
 
     # Merge global and scenario configs
@@ -260,3 +665,6 @@ def process_file(path, qmin, config):
         logging.getLogger('deckard.hint').error(
             'test failed, inspect working directory %s', context["tmpdir"])
         raise
+    finally:
+        case.timing.dump(os.path.join(context["tmpdir"], 'timing.json'))
+    return case.timing
@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import os
 import random
@@ -135,33 +136,62 @@ class TCPDump:
                                f" in scenario {unknown_addresses}")
 
 
+# Network namespace and interface manager shared by tests in this process with DECKARD_WARM
+WARM_NETWORK = None
+
+
+@contextlib.contextmanager
+def network_namespace(config):
+    """Enter network namespace for the test and set up its interface manager.
+
+    Daemons kept running between tests (DECKARD_WARM) must stay reachable, so all tests
+    share one namespace and get the same internal addresses."""
+    global WARM_NETWORK  # pylint: disable=global-statement
+    if not deckard.WARM_DAEMONS.enabled:
+        with LinuxNamespace("net"):
+            config["if_manager"] = InterfaceManager()
+            yield
+        return
+
+    if WARM_NETWORK is None:
+        namespace = LinuxNamespace("net")
+        with namespace:
+            WARM_NETWORK = (namespace, InterfaceManager())
+    namespace, if_manager = WARM_NETWORK
+    with namespace:
+        if_manager.reuse_internal_addresses()
+        config["if_manager"] = if_manager
+        yield
+
+
 def run_test(path, qmin, config, max_retries, retries=0):
+    """Run test in its own network namespace, returns timing of the scenario"""
     set_coverage_env(path, qmin)
 
     try:
-        with LinuxNamespace("net"):
-            config["if_manager"] = InterfaceManager()
+        with network_namespace(config):
             with TCPDump(config):
-                deckard.process_file(path, qmin, config)
+                return deckard.process_file(path, qmin, config)
     except deckard.DeckardUnderLoadError as e:
         if retries < max_retries:
             logging.error("Deckard under load. Retrying…")
             # Exponential backoff
             time.sleep((2 ** retries) + random.random())
-            run_test(path, qmin, config, max_retries, retries + 1)
-        else:
-            raise e
+            return run_test(path, qmin, config, max_retries, retries + 1)
+        raise e
 
 
-def test_passes_qmin_on(scenario, max_retries):
+def test_passes_qmin_on(scenario, max_retries, record_property):
     if scenario.qmin is True or scenario.qmin is None:
-        run_test(scenario.path, True, scenario.config, max_retries)
+        timing = run_test(scenario.path, True, scenario.config, max_retries)
+        record_property("timing", timing.to_json())
     else:
         pytest.skip("Query minimization is off in test config")
 
 
-def test_passes_qmin_off(scenario, max_retries):
+def test_passes_qmin_off(scenario, max_retries, record_property):
     if scenario.qmin is False or scenario.qmin is None:
-        run_test(scenario.path, False, scenario.config, max_retries)
+        timing = run_test(scenario.path, False, scenario.config, max_retries)
+        record_property("timing", timing.to_json())
     else:
         pytest.skip("Query minimization is on in test config")
@@ -70,6 +70,11 @@ class InterfaceManager:
         self._add_address(a)
         return a
 
+    def reuse_internal_addresses(self):
+        """Assign internal addresses from the beginning of the range again"""
+        self.ip4_iterator = (host for host in self.ip4_internal_range)
+        self.ip6_iterator = (host for host in self.ip6_internal_range)
+
     def add_address(self, address: str, check_duplicate=False):
         """Add an arbitrary new address to the interface"""
         if address in self.added_addresses and check_duplicate:
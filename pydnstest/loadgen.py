@@ -0,0 +1,206 @@
+"""Replay client queries against the binary under test and measure latency and throughput"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import math
+import time
+from typing import Counter, Dict, List, Optional, Sequence, Tuple  # noqa
+
+import dns.message
+import dns.rcode
+import dpkt
+
+from pydnstest import mock_client, scenario
+
+DEFAULT_DURATION = 10
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Schedule is a sequence of (offset in seconds from start, query in wire format)
+Schedule = Sequence[Tuple[float, bytes]]
+
+
+def queries_from_scenario(case) -> List[bytes]:
+    """ Return queries of all QUERY and QUERY_BATCH steps of the scenario in wire format. """
+    queries = []
+    for step in case.steps:
+        if step.type == 'QUERY' or step.type in scenario.Step.batch_types:
+            for entry in step.data:
+                if entry.raw_data is not None:
+                    queries.append(entry.raw_data)
+                else:
+                    queries.append(entry.message.to_wire())
+    return queries
+
+
+def trace_from_text(path: str) -> List[Tuple[float, bytes]]:
+    """
+    Read queries from text file with lines in format: [timestamp] qname [qtype]
+
+    Lines without timestamp follow the previous line immediately, qtype defaults to A.
+    Empty lines and lines starting with # are ignored.
+    """
+    trace = []
+    timestamp = 0.0
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            try:
+                timestamp = float(fields[0])
+                fields = fields[1:]
+            except ValueError:
+                pass
+            query = dns.message.make_query(fields[0], fields[1] if len(fields) > 1 else 'A')
+            trace.append((timestamp, query.to_wire()))
+    return trace
+
+
+def trace_from_pcap(path: str) -> List[Tuple[float, bytes]]:
+    """ Read DNS queries sent over UDP to port 53 from PCAP file. """
+    trace = []
+    with open(path, 'rb') as pcap_file:
+        pcap = dpkt.pcap.Reader(pcap_file)
+        if pcap.datalink() == dpkt.pcap.DLT_LINUX_SLL:
+            decode = dpkt.sll.SLL
+        elif pcap.datalink() == dpkt.pcap.DLT_EN10MB:
+            decode = dpkt.ethernet.Ethernet
+        else:
+            raise ValueError(f'{path}: unsupported link type {pcap.datalink()}')
+        for timestamp, packet in pcap:
+            udp = getattr(decode(packet).data, 'data', None)
+            if not isinstance(udp, dpkt.udp.UDP) or udp.dport != 53:
+                continue
+            wire = bytes(udp.data)
+            if len(wire) < 12 or wire[2] & 0x80:  # not a query
+                continue
+            trace.append((float(timestamp), wire))
+    return trace
+
+
+def read_trace(path: str) -> List[Tuple[float, bytes]]:
+    if path.endswith(('.pcap', '.cap')):
+        return trace_from_pcap(path)
+    return trace_from_text(path)
+
+
+def rate_schedule(queries: Sequence[bytes], qps: float,
+                  duration: float = DEFAULT_DURATION) -> Schedule:
+    """ Send queries repeatedly in round-robin with constant rate for given duration. """
+    if not queries:
+        raise ValueError('no queries to send')
+    count = int(qps * duration)
+    return [(i / qps, query) for i, query in zip(range(count), itertools.cycle(queries))]
+
+
+def trace_schedule(trace: Sequence[Tuple[float, bytes]], speedup: float = 1.0) -> Schedule:
+    """ Keep original inter-arrival times of the trace, shortened by speedup factor. """
+    if not trace:
+        raise ValueError('no queries to send')
+    start = trace[0][0]
+    return [((timestamp - start) / speedup, query) for timestamp, query in trace]
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """ Return pct-th percentile of sorted values using the nearest-rank method. """
+    if not values:
+        return math.nan
+    rank = math.ceil(round(pct * len(values) / 100, 6))  # round off float error, e.g. 99.9
+    return values[max(rank - 1, 0)]
+
+
+class LoadReport:
+    """ Latencies and answer rcodes measured by replay(). """
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.latencies = []  # type: List[float]
+        self.rcodes = collections.Counter()  # type: Counter[str]
+        self.duration = 0.0
+
+    @property
+    def answered(self) -> int:
+        return len(self.latencies)
+
+    def summary(self) -> Dict:
+        """ Return report as dict with latencies in milliseconds, suitable for JSON. """
+        latencies = sorted(self.latencies)
+        return {
+            'sent': self.sent,
+            'answered': self.answered,
+            'lost': self.sent - self.answered,
+            'duration': self.duration,
+            'achieved_qps': self.answered / self.duration if self.duration else 0.0,
+            'latency_ms': {f'p{pct:g}': percentile(latencies, pct) * 1000
+                           for pct in PERCENTILES},
+            'rcodes': dict(self.rcodes),
+        }
+
+    def __str__(self) -> str:
+        summary = self.summary()
+        latency = ', '.join(f'{name} {value:.2f} ms'
+                            for name, value in summary['latency_ms'].items())
+        rcodes = ', '.join(f'{name} {count}' for name, count in self.rcodes.most_common())
+        return (f'sent {summary["sent"]}, answered {summary["answered"]}, '
+                f'lost {summary["lost"]}, achieved {summary["achieved_qps"]:.1f} QPS; '
+                f'latency {latency}; rcodes {rcodes}')
+
+
+class ReplayProtocol(asyncio.DatagramProtocol):
+    """ Matches answers to outstanding queries by message ID. """
+
+    def __init__(self, report: LoadReport) -> None:
+        self.report = report
+        self.outstanding = {}  # type: Dict[int, float]
+        self.last_answer = 0.0
+        self.done = None  # type: Optional[asyncio.Future]
+
+    def datagram_received(self, data, addr):
+        sent = self.outstanding.pop(mock_client.message_id(data), None)  # type: ignore
+        if sent is None:  # unknown or too late
+            return
+        self.last_answer = time.monotonic()
+        self.report.latencies.append(self.last_answer - sent)
+        self.report.rcodes[dns.rcode.to_text(data[3] & 0xF)] += 1
+        if not self.outstanding and self.done is not None and not self.done.done():
+            self.done.set_result(None)
+
+
+async def replay(address: str, port: int, schedule: Schedule,
+                 timeout: float = mock_client.SOCKET_OPERATION_TIMEOUT,
+                 src_address: Optional[str] = None) -> LoadReport:
+    """
+    Send queries over UDP according to the schedule and collect answers.
+
+    Queries get sequential message IDs so answers can be matched. Queries not answered
+    within timeout after the last query was sent are counted as lost.
+    """
+    loop = asyncio.get_running_loop()
+    report = LoadReport()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: ReplayProtocol(report), remote_addr=(address, port),
+        local_addr=(src_address, 0) if src_address is not None else None)
+    try:
+        start = time.monotonic()
+        for msg_id, (offset, query) in enumerate(schedule):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            msg_id &= 0xFFFF
+            protocol.outstanding[msg_id] = time.monotonic()  # overwrites lost query
+            transport.sendto(mock_client.MESSAGE_ID.pack(msg_id) + query[2:])
+            report.sent += 1
+        sent = time.monotonic()
+        if protocol.outstanding:
+            protocol.done = loop.create_future()
+            try:
+                await asyncio.wait_for(protocol.done, timeout)
+            except asyncio.TimeoutError:
+                pass
+        report.duration = max(sent, protocol.last_answer) - start
+    finally:
+        transport.close()
+    logging.getLogger('pydnstest.loadgen').info('%s', report)
+    return report
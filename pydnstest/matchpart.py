@@ -1,13 +1,14 @@
 """matchpart is used to compare two DNS messages using a single criterion"""
 
 from typing import (  # noqa
-    Any, Hashable, Sequence, Tuple, Union)
+    Any, Callable, Hashable, Iterable, Sequence, Tuple, Union)
 
 import dns.edns
 import dns.rcode
 import dns.set
 
 MismatchValue = Union[str, Sequence[Any]]
+Predicate = Callable[[Any, Any], bool]
 
 
 class DataMismatch(Exception):
@@ -58,15 +59,24 @@ def compare_val(exp, got):
     return True
 
 
+def rrset_key(rrset):
+    """ Return canonical form of RR set, keys are equal if and only if RR sets are equal. """
+    return (rrset.name.canonicalize(), rrset.rdclass, rrset.rdtype, rrset.covers,
+            frozenset(rd.to_digestable(dns.name.root) for rd in rrset))
+
+
+def same_rrs(expected, got):
+    """
+    Return True if lists of RR sets have the same length and each RR set from one list
+    is present in the other one.
+    """
+    return (len(expected) == len(got)
+            and {rrset_key(rr) for rr in expected} == {rrset_key(rr) for rr in got})
+
+
 def compare_rrs(expected, got):
     """ Compare lists of RR sets, throw exception if different. """
-    for rr in expected:
-        if rr not in got:
-            raise DataMismatch(expected, got)
-    for rr in got:
-        if rr not in expected:
-            raise DataMismatch(expected, got)
-    if len(expected) != len(got):
+    if not same_rrs(expected, got):
         raise DataMismatch(expected, got)
     return True
 
@@ -237,3 +247,120 @@ def match_part(exp, got, code):
         return MATCH[code](exp, got)
     except KeyError as ex:
         raise NotImplementedError(f'unknown match request "{code}"') from ex
+
+
+# Exception-free variants of MATCH functions, see matches()
+def same_question(exp, got, key):
+    check_question(exp.question)
+    check_question(got.question)
+    if not exp.question or not got.question:
+        return not exp.question and not got.question
+    return key(exp.question[0]) == key(got.question[0])
+
+
+def no_mismatch(match, exp, got):
+    """Run MATCH function and return False if it raised DataMismatch."""
+    try:
+        match(exp, got)
+    except DataMismatch:
+        return False
+    return True
+
+
+def is_opcode(exp, got):
+    return exp.opcode() == got.opcode()
+
+
+def is_qtype(exp, got):
+    return same_question(exp, got, lambda rrset: rrset.rdtype)
+
+
+def is_qname(exp, got):
+    return same_question(exp, got, lambda rrset: rrset.name)
+
+
+def is_qcase(exp, got):
+    return same_question(exp, got, lambda rrset: rrset.name.labels)
+
+
+def is_subdomain(exp, got):
+    if not exp.question:
+        return True
+    qname = got.question[0].name if got.question else dns.name.root
+    return exp.question[0].name.is_superdomain(qname)
+
+
+def is_flags(exp, got):
+    return dns.flags.to_text(exp.flags) == dns.flags.to_text(got.flags)
+
+
+def is_rcode(exp, got):
+    return exp.rcode() == got.rcode()
+
+
+def is_answer(exp, got):
+    return same_rrs(exp.answer, got.answer)
+
+
+def is_answertypes(exp, got):
+    return no_mismatch(match_answertypes, exp, got)
+
+
+def is_answerrrsigs(exp, got):
+    return no_mismatch(match_answerrrsigs, exp, got)
+
+
+def is_authority(exp, got):
+    return same_rrs(exp.authority, got.authority)
+
+
+def is_additional(exp, got):
+    return same_rrs(exp.additional, got.additional)
+
+
+def is_edns(exp, got):
+    return exp.edns == got.edns and exp.payload == got.payload
+
+
+def is_nsid(exp, got):
+    return no_mismatch(match_nsid, exp, got)
+
+
+# Cheap checks go first so mismatching candidates are rejected early
+PREDICATES = {"opcode": is_opcode, "qtype": is_qtype, "qname": is_qname, "qcase": is_qcase,
+              "subdomain": is_subdomain, "flags": is_flags, "rcode": is_rcode,
+              "edns": is_edns, "nsid": is_nsid, "answertypes": is_answertypes,
+              "answerrrsigs": is_answerrrsigs, "answer": is_answer, "authority": is_authority,
+              "additional": is_additional}
+
+
+def check_fields(fields: Iterable[str]) -> None:
+    """ Raise NotImplementedError if any of match field names is not supported. """
+    unknown = set(fields) - PREDICATES.keys()
+    if unknown:
+        raise NotImplementedError(f'unknown match request "{unknown.pop()}"')
+
+
+def compile_matchers(fields: Iterable[str]) -> Tuple[Predicate, ...]:
+    """
+    Translate match field names to predicates, result can be passed to matches().
+
+    Predicates are ordered from the cheapest one, duplicate fields are ignored.
+    """
+    fields = set(fields)
+    check_fields(fields)
+    return tuple(predicate for code, predicate in PREDICATES.items() if code in fields)
+
+
+def matches(exp, got, fields: Iterable[Union[str, Predicate]]) -> bool:
+    """
+    Return True if messages match in all given fields.
+
+    Unlike match_part() no DataMismatch is constructed, so this is suitable for probing
+    many candidates. Fields are names or predicates precompiled by compile_matchers().
+    """
+    for field in fields:
+        predicate = compile_matchers([field])[0] if isinstance(field, str) else field
+        if not predicate(exp, got):
+            return False
+    return True
@@ -1,10 +1,15 @@
 """Module takes care of sending and recieving DNS messages as a mock client"""
 
+import collections
 import errno
+import logging
+import os
+import select
 import socket
 import struct
+import threading
 import time
-from typing import Optional, Tuple, Union
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union  # noqa
 
 import dns.message
 import dns.inet
@@ -13,6 +18,12 @@ import dns.inet
 SOCKET_OPERATION_TIMEOUT = 5
 RECEIVE_MESSAGE_SIZE = 2**16-1
 THROTTLE_BY = 0.1
+TCP_LENGTH = struct.Struct("!H")
+MESSAGE_ID = struct.Struct("!H")
+
+# Messages are received into preallocated per-thread buffer, test server and client
+# run in different threads
+_buffers = threading.local()
 
 
 def handle_socket_timeout(sock: socket.socket, deadline: float):
@@ -23,18 +34,32 @@ def handle_socket_timeout(sock: socket.socket, deadline: float):
     sock.settimeout(remaining)
 
 
-def recv_n_bytes_from_tcp(stream: socket.socket, n: int, deadline: float) -> bytes:
+def receive_buffer() -> memoryview:
+    """ Returns preallocated buffer large enough for any DNS message, one per thread """
+    try:
+        return _buffers.view
+    except AttributeError:
+        _buffers.view = memoryview(bytearray(RECEIVE_MESSAGE_SIZE))
+        return _buffers.view
+
+
+def recv_into_from_tcp(stream: socket.socket, view: memoryview, deadline: float) -> None:
+    """ Fill the whole view with data from TCP stream """
     # deadline is always time.monotonic
-    data = b""
-    while n != 0:
+    while view:
         handle_socket_timeout(stream, deadline)
-        chunk = stream.recv(n)
-        # Empty bytes from socket.recv mean that socket is closed
-        if not chunk:
+        received = stream.recv_into(view)
+        # Zero bytes from socket.recv_into mean that socket is closed
+        if not received:
             raise OSError()
-        n -= len(chunk)
-        data += chunk
-    return data
+        view = view[received:]
+
+
+def recv_n_bytes_from_tcp(stream: socket.socket, n: int, deadline: float) -> bytes:
+    # deadline is always time.monotonic
+    data = bytearray(n)
+    recv_into_from_tcp(stream, memoryview(data), deadline)
+    return bytes(data)
 
 
 def recvfrom_blob(sock: socket.socket,
@@ -45,22 +70,23 @@ def recvfrom_blob(sock: socket.socket,
 
     # deadline is always time.monotonic
     deadline = time.monotonic() + timeout
+    buf = receive_buffer()
 
     while True:
         try:
             if sock.type & socket.SOCK_DGRAM:
                 handle_socket_timeout(sock, deadline)
-                data, addr = sock.recvfrom(RECEIVE_MESSAGE_SIZE)
+                msg_len, addr = sock.recvfrom_into(buf)
             elif sock.type & socket.SOCK_STREAM:
                 # First 2 bytes of TCP packet are the size of the message
                 # See https://tools.ietf.org/html/rfc1035#section-4.2.2
-                data = recv_n_bytes_from_tcp(sock, 2, deadline)
-                msg_len = struct.unpack_from("!H", data)[0]
-                data = recv_n_bytes_from_tcp(sock, msg_len, deadline)
+                recv_into_from_tcp(sock, buf[:TCP_LENGTH.size], deadline)
+                msg_len = TCP_LENGTH.unpack_from(buf)[0]
+                recv_into_from_tcp(sock, buf[:msg_len], deadline)
                 addr = sock.getpeername()[0]
             else:
                 raise NotImplementedError(f"[recvfrom_blob]: unknown socket type '{sock.type}'")
-            return data, addr
+            return bytes(buf[:msg_len]), addr
         except socket.timeout as ex:
             raise RuntimeError("Server took too long to respond") from ex
         except OSError as ex:
@@ -70,6 +96,17 @@ def recvfrom_blob(sock: socket.socket,
                 raise
 
 
+def recvfrom_nowait(sock: socket.socket) -> Tuple[bytes, Any]:
+    """
+    Receive DNS message from blocking UDP socket without waiting.
+
+    Raises BlockingIOError if there is no message to receive.
+    """
+    buf = receive_buffer()
+    msg_len, addr = sock.recvfrom_into(buf, 0, socket.MSG_DONTWAIT)
+    return bytes(buf[:msg_len]), addr
+
+
 def recvfrom_msg(sock: socket.socket,
                  timeout: int = SOCKET_OPERATION_TIMEOUT) -> Tuple[dns.message.Message, str]:
     data, addr = recvfrom_blob(sock, timeout=timeout)
@@ -86,8 +123,7 @@ def sendto_msg(sock: socket.socket, message: bytes, addr: Optional[str] = None)
             else:
                 sock.sendto(message, addr)
         elif sock.type & socket.SOCK_STREAM:
-            data = struct.pack("!H", len(message)) + message
-            sock.sendall(data)
+            sendall_buffers(sock, (TCP_LENGTH.pack(len(message)), message))
         else:
             raise NotImplementedError(f"[sendto_msg]: unknown socket type '{sock.type}'")
     except OSError as ex:
@@ -96,6 +132,17 @@ def sendto_msg(sock: socket.socket, message: bytes, addr: Optional[str] = None)
             raise
 
 
+def sendall_buffers(sock: socket.socket, buffers: Sequence[bytes]) -> None:
+    """ Send all buffers using scatter-gather I/O, i.e. without joining them first """
+    views = [memoryview(buf) for buf in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if views:
+            views[0] = views[0][sent:]
+
+
 def setup_socket(address: str,
                  port: int,
                  tcp: bool = False,
@@ -134,3 +181,169 @@ def get_answer(sock: socket.socket, timeout: int = SOCKET_OPERATION_TIMEOUT) ->
 def get_dns_message(sock: socket.socket,
                     timeout: int = SOCKET_OPERATION_TIMEOUT) -> dns.message.Message:
     return dns.message.from_wire(get_answer(sock, timeout=timeout))
+
+
+def message_id(wire: bytes) -> Optional[int]:
+    """ Returns ID of DNS message in wire format, None for messages too short to have one """
+    if len(wire) < MESSAGE_ID.size:
+        return None
+    return MESSAGE_ID.unpack_from(wire)[0]
+
+
+def discard_pending(sock: socket.socket) -> int:
+    """ Discard all messages waiting in UDP socket, returns number of discarded messages """
+    discarded = 0
+    buf = receive_buffer()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv_into(buf)
+            discarded += 1
+    except BlockingIOError:
+        return discarded
+    finally:
+        sock.settimeout(timeout)
+
+
+def wait_readable(sock: socket.socket, interrupt: int, timeout: float) -> None:
+    """ Wait for data in the socket, raise InterruptedError if interrupt fd becomes readable """
+    readable, _, _ = select.select([sock.fileno(), interrupt], [], [], timeout)
+    if interrupt in readable:
+        raise InterruptedError('waiting for answer interrupted')
+    if not readable:
+        raise RuntimeError("Server took too long to respond")
+
+
+def get_answers(sock: socket.socket, queries: Sequence[bytes],
+                timeout: int = SOCKET_OPERATION_TIMEOUT,
+                timestamps: Optional[List[float]] = None,
+                interrupt: Optional[int] = None) -> List[bytes]:
+    """
+    Receive answers to all queries sent over the socket, in any order.
+
+    Answers are matched to queries by message ID and returned in order of the queries.
+    Message not matching any outstanding query is taken as the answer to the first query
+    without answer, so the wrong ID is reported by checks of the answer instead of a timeout.
+    If timestamps list is given, it is filled with time.monotonic() of reception
+    of each answer in the same order.
+    Waiting for answers stops with InterruptedError when interrupt fd becomes readable.
+    """
+    log = logging.getLogger('pydnstest.mock_client.get_answers')
+    outstanding = {}  # type: Dict[Optional[int], Deque[int]]
+    for position, query in enumerate(queries):
+        outstanding.setdefault(message_id(query), collections.deque()).append(position)
+    unanswered = list(range(len(queries)))
+    answers = [b''] * len(queries)
+    received = [0.0] * len(queries)
+    for _ in range(len(queries)):
+        if interrupt is not None:
+            wait_readable(sock, interrupt, timeout)
+        answer = get_answer(sock, timeout=timeout)
+        positions = outstanding.get(message_id(answer))
+        if positions:
+            position = positions.popleft()
+        else:
+            position = unanswered[0]
+            outstanding[message_id(queries[position])].remove(position)
+            log.debug('answer with unexpected ID %s taken as answer to query %d',
+                      message_id(answer), position + 1)
+        unanswered.remove(position)
+        answers[position] = answer
+        received[position] = time.monotonic()
+    if timestamps is not None:
+        timestamps[:] = received
+    return answers
+
+
+ClientKey = Tuple[str, int, bool, Optional[str]]
+
+
+class ClientPool:
+    """
+    Client sockets shared by scenario steps, keyed by target address, port, protocol
+    and source address.
+
+    UDP sockets are reused for the whole scenario. TCP connections are reused only
+    with keep_tcp, otherwise each exchange uses a new connection.
+    """
+
+    def __init__(self, keep_tcp: bool = False) -> None:
+        self.keep_tcp = keep_tcp
+        self.sockets = {}  # type: Dict[ClientKey, socket.socket]
+        # Pipe interrupting exchanges waiting for answers, see abort()
+        self.wakeup = os.pipe()
+        self.abort_reason = None  # type: Optional[str]
+
+    def __enter__(self) -> 'ClientPool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+        for fd in self.wakeup:
+            os.close(fd)
+        self.wakeup = (-1, -1)
+
+    def abort(self, reason: str) -> None:
+        """
+        Make exchanges in progress and all following exchanges fail with ValueError(reason).
+
+        Can be called from another thread.
+        """
+        self.abort_reason = reason
+        try:
+            os.write(self.wakeup[1], b'\0')
+        except OSError:
+            pass  # the pool was closed already
+
+    def exchange(self, address: str, port: int, queries: Sequence[bytes], *, tcp: bool = False,
+                 src_address: Optional[str] = None, expect_answers: bool = True,
+                 timestamps: Optional[List[float]] = None) -> Optional[List[bytes]]:
+        """
+        Send all queries at once (pipelined over TCP) and wait for all answers.
+
+        Returns answers in order of the queries, or None if answers are not expected.
+        Reception times of answers are stored into timestamps, see get_answers().
+        Kept open TCP connection closed by the other side is reopened once.
+        """
+        key = (address, port, tcp, src_address)
+        sock = self.sockets.pop(key, None)
+        if sock is not None and tcp:
+            try:
+                return self._exchange(key, sock, queries, expect_answers, timestamps)
+            except OSError:
+                pass  # stale connection, _exchange() closed it
+        elif sock is not None:
+            # answers which arrived too late for previous exchanges
+            discard_pending(sock)
+            return self._exchange(key, sock, queries, expect_answers, timestamps)
+        sock = setup_socket(address, port, tcp, src_address=src_address)
+        return self._exchange(key, sock, queries, expect_answers, timestamps)
+
+    def _exchange(self, key: ClientKey, sock: socket.socket, queries: Sequence[bytes],
+                  expect_answers: bool,
+                  timestamps: Optional[List[float]]) -> Optional[List[bytes]]:
+        reuse = False
+        try:
+            if self.abort_reason is not None:
+                raise ValueError(self.abort_reason)
+            for query in queries:
+                send_query(sock, query)
+            answers = None
+            if expect_answers:
+                answers = get_answers(sock, queries, timestamps=timestamps,
+                                      interrupt=self.wakeup[0])
+            reuse = not key[2] or self.keep_tcp
+            return answers
+        except InterruptedError as ex:
+            raise ValueError(self.abort_reason) from ex
+        finally:
+            if reuse:
+                self.sockets[key] = sock
+            else:
+                sock.close()
@@ -0,0 +1,384 @@
+"""
+Native single-pass parser for Deckard .rpl scenario files.
+
+The parser follows grammar defined by the Augeas lens in deckard.aug and produces
+a tree with the same shape (labels, values and ordering of nodes) as the tree
+exposed by augwrap.AugeasNode. The tree is read-only and implements the subset
+of AugeasNode interface used by scenario.py and rplint.py, so both parsers
+can be used interchangeably.
+
+Comments are not stored in the tree.
+"""
+
+import os
+import re
+from typing import Iterator, List, Optional, Tuple  # noqa
+
+MATCH_OPTIONS = {"opcode", "qtype", "qcase", "qname", "subdomain", "flags", "rcode",
+                 "question", "answer", "authority", "additional", "all", "edns"}
+ADJUST_OPTIONS = {"copy_id", "copy_query", "raw_id", "do_not_answer"}
+REPLY_OPTIONS = {"QR", "TC", "AA", "AD", "RD", "RA", "CD", "DO", "NOERROR", "FORMERR",
+                 "SERVFAIL", "NXDOMAIN", "NOTIMP", "REFUSED", "YXDOMAIN", "YXRRSET",
+                 "NXRRSET", "NOTAUTH", "NOTZONE", "BADVERS", "BADSIG", "BADKEY", "BADTIME",
+                 "BADMODE", "BADNAME", "BADALG", "BADTRUNC", "BADCOOKIE"}
+SECTIONS = ("question", "answer", "authority", "additional")
+
+CLASS_RE = r'(?:CLASS[0-9]+|IN|CH|HS|NONE|ANY)'
+RANGE_RE = re.compile(r'RANGE_BEGIN\s+([0-9]+)\s+([0-9]+)(?:\s+([0-9a-f.:]+))?$')
+ADDRESS_RE = re.compile(r'ADDRESS\s+([0-9a-f.:]+)$')
+STEP_RE = re.compile(r'STEP\s+([0-9]+)\s+'
+                     r'(REPLY|QUERY_BATCH(?:\s+TCP)?|QUERY|CHECK_ANSWER|CHECK_OUT_QUERY'
+                     r'|TIME_PASSES\s+ELAPSE)'
+                     r'(?:\s+([0-9]+))?$')
+DELAY_RE = re.compile(r'DELAY\s+([0-9]+)(?:\s+([0-9]+))?$')
+LOSS_RE = re.compile(r'LOSS\s+([0-9]*\.?[0-9]+)$')
+TSIG_RE = re.compile(r'TSIG\s+([^\s/]+)\s+([^\s/]+)$')
+QUESTION_RE = re.compile(r'(\S+)\s+(?:(' + CLASS_RE + r')\s+)?(\S+)$')
+RECORD_RE = re.compile(r'(\S+)\s+(?:([0-9]+)\s+)?(?:(' + CLASS_RE + r')\s+)?(\S+)\s+(\S.*)$')
+CLASS_ONLY_RE = re.compile(CLASS_RE + '$')
+HEX_RE = re.compile(r'[0-9a-fA-F]+$')
+CONFIG_STOP_RE = re.compile(r'(STEP|SCENARIO|RANGE|ENTRY)')
+
+
+class RplSyntaxError(ValueError):
+    def __init__(self, path: str, line: int, msg: str) -> None:
+        super().__init__(f'{path}:{line}: {msg}')
+        self.path = path
+        self.line = line
+
+
+class RplNode:
+    """One node of parsed scenario with read-only AugeasNode-like interface."""
+
+    __slots__ = ('label', 'value', 'children', 'parent', 'char', 'line', '_path')
+
+    def __init__(self, label: str, value: Optional[str] = None,
+                 parent: Optional['RplNode'] = None, char: int = 0, line: int = 0) -> None:
+        self.label = label
+        self.value = value
+        self.children = []  # type: List[RplNode]
+        self.parent = parent
+        self.char = char
+        self.line = line
+        self._path = None  # type: Optional[str]
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def path(self) -> str:
+        """Augeas-like path of the node, e.g. /files/a.rpl/scenario/range[2]/entry[1]"""
+        if self._path is None:
+            assert self.parent is not None
+            siblings = [c for c in self.parent.children if c.label == self.label]
+            suffix = ''
+            if len(siblings) > 1:
+                suffix = f'[{siblings.index(self) + 1}]'
+            self._path = f'{self.parent.path}/{self.label}{suffix}'
+        return self._path
+
+    @property
+    def span(self) -> str:
+        return f"line {self.line} (char position {self.char})"
+
+    def match(self, subpath: str) -> Iterator['RplNode']:
+        """Yield nodes matching given sub-expression, only labels and * are supported."""
+        assert subpath.startswith("/")
+        nodes = [self]
+        for label in subpath[1:].split('/'):
+            nodes = [child for node in nodes for child in node.children
+                     if label in ('*', child.label)]
+        return iter(nodes)
+
+    def __getitem__(self, key: str) -> 'RplNode':
+        nodes = list(self.match(key))
+        if len(nodes) != 1:
+            raise KeyError(f'path {self.path}{key} did not match exactly once')
+        return nodes[0]
+
+    def __repr__(self):
+        return f'RplNode({self.path})'
+
+
+class _Parser:
+    """Recursive descent parser operating on significant (non-empty) lines."""
+
+    def __init__(self, text: str, path: str) -> None:
+        self.path = path
+        self.lines = []  # type: List[Tuple[int, int, str, str]]
+        char = 0
+        for lineno, raw_line in enumerate(text.splitlines(keepends=True), start=1):
+            # (line number, char offset, raw line, line stripped of comments and indentation)
+            line = raw_line.rstrip('\r\n')
+            content = line.split(';', 1)[0].strip()
+            self.lines.append((lineno, char + len(line) - len(line.lstrip()), line, content))
+            char += len(raw_line)
+        self.idx = 0
+
+    def error(self, msg: str, lineno: Optional[int] = None) -> RplSyntaxError:
+        if lineno is None:
+            lineno = self.lines[min(self.idx, len(self.lines) - 1)][0] if self.lines else 0
+        return RplSyntaxError(self.path, lineno, msg)
+
+    def peek(self) -> Optional[Tuple[int, int, str]]:
+        """Return next significant line as (line number, char offset, content)."""
+        while self.idx < len(self.lines):
+            lineno, char, _, content = self.lines[self.idx]
+            if content:
+                return lineno, char, content
+            self.idx += 1
+        return None
+
+    def next(self, what: str) -> Tuple[int, int, str]:
+        line = self.peek()
+        if line is None:
+            raise self.error(f'unexpected end of file, expected {what}')
+        self.idx += 1
+        return line
+
+    def expect(self, keyword: str) -> Tuple[int, int, str]:
+        lineno, char, content = self.next(keyword)
+        if content.split(None, 1)[0] != keyword:
+            raise self.error(f'expected {keyword}, got "{content}"', lineno)
+        return lineno, char, content
+
+    def parse(self) -> RplNode:
+        root = RplNode('files')
+        root._path = os.path.normpath(f'/files/{self.path}')  # pylint: disable=protected-access
+        self.parse_config(root)
+        self.parse_scenario(root)
+        if self.peek() is not None:
+            raise self.error('unexpected data after SCENARIO_END')
+        return root
+
+    def parse_config(self, root: RplNode) -> None:
+        """Config is a list of raw lines terminated by CONFIG_END."""
+        for idx, (_, _, line, content) in enumerate(self.lines):
+            if content == 'CONFIG_END':
+                break
+            if CONFIG_STOP_RE.match(line):
+                return  # no config section, scenario must follow right away
+        else:
+            return
+        lineno, char, _, _ = self.lines[0]
+        config = RplNode('config', parent=root, char=char, line=lineno)
+        for seq, (lineno, char, line, _) in enumerate(self.lines[:idx], start=1):
+            RplNode(str(seq), line, parent=config, char=char, line=lineno)
+        self.idx = idx + 1
+
+    def parse_scenario(self, root: RplNode) -> None:
+        lineno, char, content = self.expect('SCENARIO_BEGIN')
+        try:
+            info = content.split(None, 1)[1]
+        except IndexError:
+            raise self.error('scenario description missing', lineno) from None
+        scenario = RplNode('scenario', info, parent=root, char=char, line=lineno)
+        while True:
+            line = self.peek()
+            if line is None:
+                raise self.error('unexpected end of file, expected SCENARIO_END')
+            keyword = line[2].split(None, 1)[0]
+            if keyword == 'SCENARIO_END':
+                self.idx += 1
+                return
+            elif keyword == 'RANGE_BEGIN':
+                self.parse_range(scenario)
+            elif keyword == 'STEP':
+                self.parse_step(scenario)
+            else:
+                raise self.error(f'expected STEP, RANGE_BEGIN or SCENARIO_END, got "{line[2]}"')
+
+    def parse_range(self, scenario: RplNode) -> None:
+        lineno, char, content = self.next('RANGE_BEGIN')
+        m = RANGE_RE.match(content)
+        if m is None:
+            raise self.error(f'invalid RANGE_BEGIN line "{content}"', lineno)
+        rng = RplNode('range', parent=scenario, char=char, line=lineno)
+        RplNode('from', m.group(1), parent=rng, char=char, line=lineno)
+        RplNode('to', m.group(2), parent=rng, char=char, line=lineno)
+        if m.group(3) is not None:
+            RplNode('address', m.group(3), parent=rng, char=char, line=lineno)
+
+        addresses = None
+        while True:
+            lineno, char, content = self.next('RANGE_END')
+            keyword = content.split(None, 1)[0]
+            if keyword == 'RANGE_END':
+                if content != 'RANGE_END':
+                    raise self.error(f'unexpected data after RANGE_END "{content}"', lineno)
+                return
+            elif keyword == 'ADDRESS':
+                m = ADDRESS_RE.match(content)
+                if m is None:
+                    raise self.error(f'invalid ADDRESS line "{content}"', lineno)
+                if rng.children[-1].label == 'entry':
+                    raise self.error('ADDRESS must precede all entries in RANGE', lineno)
+                if addresses is None:
+                    addresses = RplNode('address', parent=rng, char=char, line=lineno)
+                RplNode(str(len(addresses.children) + 1), m.group(1),
+                        parent=addresses, char=char, line=lineno)
+            elif keyword in ('DELAY', 'LOSS'):
+                if rng.children[-1].label == 'entry':
+                    raise self.error(f'{keyword} must precede all entries in RANGE', lineno)
+                if keyword == 'DELAY':
+                    self.parse_delay(rng, lineno, char, content)
+                else:
+                    m = LOSS_RE.match(content)
+                    if m is None:
+                        raise self.error(f'invalid LOSS line "{content}"', lineno)
+                    RplNode('loss', m.group(1), parent=rng, char=char, line=lineno)
+            elif keyword == 'ENTRY_BEGIN':
+                self.idx -= 1
+                self.parse_entry(rng)
+            else:
+                raise self.error('expected ADDRESS, DELAY, LOSS, ENTRY_BEGIN or RANGE_END, '
+                                 f'got "{content}"', lineno)
+
+    def parse_delay(self, parent: RplNode, lineno: int, char: int, content: str) -> None:
+        m = DELAY_RE.match(content)
+        if m is None:
+            raise self.error(f'invalid DELAY line "{content}"', lineno)
+        if any(child.label == 'delay' for child in parent.children):
+            raise self.error('duplicate DELAY', lineno)
+        delay = RplNode('delay', parent=parent, char=char, line=lineno)
+        RplNode('time', m.group(1), parent=delay, char=char, line=lineno)
+        if m.group(2) is not None:
+            RplNode('jitter', m.group(2), parent=delay, char=char, line=lineno)
+
+    def parse_step(self, scenario: RplNode) -> None:
+        lineno, char, content = self.next('STEP')
+        m = STEP_RE.match(content)
+        if m is None:
+            raise self.error(f'invalid STEP line "{content}"', lineno)
+        step = RplNode('step', m.group(1), parent=scenario, char=char, line=lineno)
+        RplNode('type', m.group(2), parent=step, char=char, line=lineno)
+        if m.group(3) is not None:
+            RplNode('timestamp', m.group(3), parent=step, char=char, line=lineno)
+        line = self.peek()
+        while line is not None and line[2].split(None, 1)[0] == 'ENTRY_BEGIN':
+            self.parse_entry(step)
+            line = self.peek()
+
+    def parse_entry(self, parent: RplNode) -> None:  # pylint: disable=too-many-statements
+        lineno, char, content = self.expect('ENTRY_BEGIN')
+        if content != 'ENTRY_BEGIN':
+            raise self.error(f'unexpected data after ENTRY_BEGIN "{content}"', lineno)
+        entry = RplNode('entry', parent=parent, char=char, line=lineno)
+        seen = set()
+        sections = None
+        section = None
+        while True:
+            lineno, char, content = self.next('ENTRY_END')
+            keyword, *args = content.split()
+            if keyword == 'ENTRY_END':
+                if content != 'ENTRY_END':
+                    raise self.error(f'unexpected data after ENTRY_END "{content}"', lineno)
+                break
+            if keyword == 'RAW':
+                if content != 'RAW':
+                    raise self.error(f'unexpected data after RAW "{content}"', lineno)
+                if sections is None:
+                    sections = RplNode('section', parent=entry, char=char, line=lineno)
+                hex_lineno, _, hexdata = self.next('RAW data')
+                if not HEX_RE.match(hexdata):
+                    raise self.error(f'invalid RAW data "{hexdata}"', hex_lineno)
+                RplNode('raw', hexdata, parent=entry, char=char, line=lineno)
+                self.expect('ENTRY_END')
+                self.idx -= 1
+            elif keyword == 'SECTION':
+                if sections is None:
+                    sections = RplNode('section', parent=entry, char=char, line=lineno)
+                name = args[0].lower() if len(args) == 1 else None
+                if name not in SECTIONS or args[0] != name.upper():
+                    raise self.error(f'invalid SECTION line "{content}"', lineno)
+                if section is not None and SECTIONS.index(name) <= SECTIONS.index(section.label):
+                    raise self.error(f'SECTION {args[0]} is out of order', lineno)
+                section = RplNode(name, parent=sections, char=char, line=lineno)
+            elif section is not None:
+                self.parse_record(section, lineno, char, content)
+            elif keyword == 'MANDATORY':
+                if args:
+                    raise self.error(f'unexpected data after MANDATORY "{content}"', lineno)
+                RplNode('mandatory', 'true', parent=entry, char=char, line=lineno)
+            elif keyword == 'TSIG':
+                m = TSIG_RE.match(content)
+                if m is None:
+                    raise self.error(f'invalid TSIG line "{content}"', lineno)
+                tsig = RplNode('tsig', parent=entry, char=char, line=lineno)
+                RplNode('keyname', m.group(1), parent=tsig, char=char, line=lineno)
+                RplNode('secret', m.group(2), parent=tsig, char=char, line=lineno)
+            elif keyword == 'DELAY':
+                self.parse_delay(entry, lineno, char, content)
+            elif keyword in ('MATCH', 'ADJUST', 'REPLY', 'FLAGS'):
+                label, options = {
+                    'MATCH': ('match', MATCH_OPTIONS),
+                    'ADJUST': ('adjust', ADJUST_OPTIONS),
+                    'REPLY': ('reply', REPLY_OPTIONS),
+                    'FLAGS': ('reply', REPLY_OPTIONS)}[keyword]
+                if label in seen:
+                    raise self.error(f'duplicate {keyword} in ENTRY', lineno)
+                seen.add(label)
+                if not args:
+                    raise self.error(f'{keyword} requires at least one value', lineno)
+                if label == 'match':
+                    RplNode('match_present', 'true', parent=entry, char=char, line=lineno)
+                for arg in args:
+                    if arg not in options:
+                        raise self.error(f'unsupported {keyword} value "{arg}"', lineno)
+                    RplNode(label, arg, parent=entry, char=char, line=lineno)
+            else:
+                raise self.error(f'unexpected line in ENTRY "{content}"', lineno)
+        if sections is None:
+            RplNode('section', parent=entry, char=char, line=lineno)
+
+    def parse_record(self, section: RplNode, lineno: int, char: int, content: str) -> None:
+        if section.label == 'question':
+            if section.children:
+                raise self.error('more than one record in SECTION QUESTION', lineno)
+            m = QUESTION_RE.match(content)
+            labels = ('domain', 'class', 'type')  # type: Tuple[str, ...]
+        else:
+            m = RECORD_RE.match(content)
+            labels = ('domain', 'ttl', 'class', 'type', 'data')
+        fields = dict(zip(labels, m.groups())) if m is not None else {}
+        if (not fields or fields['domain'] == 'SECTION'
+                or fields['type'][0].isdigit() or CLASS_ONLY_RE.match(fields['type'])):
+            raise self.error(f'invalid record "{content}" in SECTION {section.label.upper()}',
+                             lineno)
+        record = RplNode('record', parent=section, char=char, line=lineno)
+        for label, value in fields.items():
+            if value is not None:
+                RplNode(label, value.strip(), parent=record, char=char, line=lineno)
+
+
+def parse_string(text: str, path: str = 'scenario.rpl') -> RplNode:
+    """Parse scenario text and return the root node of the tree."""
+    return _Parser(text, path).parse()
+
+
+def parse_file(path: str) -> RplNode:
+    """Parse scenario from a file and return the root node of the tree."""
+    with open(path, encoding='utf-8') as rpl_file:
+        return parse_string(rpl_file.read(), path)
+
+
+def _node_label(node) -> str:
+    return os.path.basename(node.path).split('[', 1)[0]
+
+
+def compare_trees(expected, got) -> None:
+    """
+    Compare two scenario trees (e.g. from Augeas and native parser) node by node.
+
+    Comments are ignored. Raises ValueError describing the first difference.
+    """
+    exp_children = [c for c in expected.match('/*') if _node_label(c) != 'comment']
+    got_children = [c for c in got.match('/*') if _node_label(c) != 'comment']
+    if [_node_label(c) for c in exp_children] != [_node_label(c) for c in got_children]:
+        raise ValueError(f'parser mismatch at {expected.path}: children '
+                         f'{[_node_label(c) for c in exp_children]} != '
+                         f'{[_node_label(c) for c in got_children]}')
+    for exp_child, got_child in zip(exp_children, got_children):
+        if (exp_child.value or None) != (got_child.value or None):
+            raise ValueError(f'parser mismatch at {exp_child.path}: '
+                             f'value "{exp_child.value}" != "{got_child.value}"')
+        compare_trees(exp_child, got_child)
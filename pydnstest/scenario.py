@@ -1,14 +1,19 @@
+# pylint: disable=too-many-lines
 from abc import ABC
 import binascii
+import bisect
 import calendar
+import concurrent.futures
+import copy
 from datetime import datetime
+import heapq
 import logging
 import os  # requires posix
 import random
 import socket
 import struct
 import time
-from typing import Optional
+from typing import Dict, List, Optional  # noqa
 
 import dns.dnssec
 import dns.message
@@ -17,9 +22,10 @@ import dns.rcode
 import dns.rrset
 import dns.tsigkeyring
 
-import pydnstest.augwrap
 import pydnstest.matchpart
 import pydnstest.mock_client
+import pydnstest.rplparser
+import pydnstest.timing
 
 
 def str2bool(v):
@@ -27,12 +33,41 @@ def str2bool(v):
     return v.lower() in ('yes', 'true', 'on', '1')
 
 
-# Global statistics
-g_rtt = 0.0
-g_nqueries = 0
+def node_file(node):
+    """ Return path of the scenario file the parsed node comes from. """
+    return node.path.rsplit('/scenario/', 1)[0][len('/files'):]
+
+
+def parse_delay(node):
+    """ Return (delay, jitter) in seconds from DELAY line of RANGE or ENTRY, None if missing. """
+    try:
+        delay = node["/delay"]
+    except KeyError:
+        return None
+    try:
+        jitter = int(delay["/jitter"].value) / 1000
+    except KeyError:
+        jitter = 0.0
+    return int(delay["/time"].value) / 1000, jitter
+
+
+def sample_delay(delay):
+    """ Return random delay in seconds from (delay, jitter) interval, never negative. """
+    base, jitter = delay
+    return max(base + random.uniform(-jitter, jitter), 0.0)
+
+
+def question_key(message):
+    """ Return (qname, qtype) of the message question or None if the question is empty. """
+    if not message.question:
+        return None
+    return message.question[0].name, message.question[0].rdtype
 
 
 class DNSBlob(ABC):
+    # Seconds the test server waits before sending the reply
+    delay = 0.0
+
     def to_wire(self) -> bytes:
         raise NotImplementedError
 
@@ -52,26 +87,101 @@ class DNSMessage(DNSBlob):
         return str(self.message)
 
 
+class ReplyTemplate:
+    """
+    Reply rendered to wire format in advance with offsets of fields which depend on the query,
+    see DNSReply.adjust_reply().
+
+    Raises ValueError if the message cannot be adjusted in wire format.
+    """
+    OPT_TTL = struct.Struct('!I')
+
+    def __init__(self, message: dns.message.Message) -> None:
+        if message.keyring is not None or message.xfr or message.rcode() > 15:
+            raise ValueError('TSIG, XFR and extended RCODE need full message adjustment')
+        self.id = message.id
+        self.question = message.question[0] if len(message.question) == 1 else None
+        if message.question and self.question is None:
+            raise ValueError('more than one question')
+
+        # Render adjusted message for queries without and with EDNS
+        query = dns.message.Message(id=0)
+        query.question = list(message.question)
+        self.wire = DNSReply(message, query, copy_id=True).to_wire()
+        query.use_edns(edns=0, ednsflags=0)
+        wire_edns = DNSReply(message, query, copy_id=True).to_wire()
+        # OPT record must be the last one, appended after otherwise identical message
+        self.opt_offset = len(self.wire)
+        if (wire_edns[:10] != self.wire[:10]
+                or wire_edns[12:self.opt_offset] != self.wire[12:]
+                or wire_edns[self.opt_offset:self.opt_offset + 3] != b'\x00\x00\x29'):
+            raise ValueError('unexpected placement of OPT record')
+        self.wire_edns = wire_edns
+        self.ext_rcode = wire_edns[self.opt_offset + 5] << 24
+        self.qname_end = 12
+        if self.question is not None:
+            self.qname_end += len(self.question.name.to_wire())  # type: ignore
+
+    def adjust(self, query: dns.message.Message,
+               copy_id: bool, copy_query: bool) -> Optional[bytes]:
+        """ Return wire of the reply adjusted for query or None if it cannot be patched. """
+        if self.question is not None:
+            if not query.question or query.question[0].name != self.question.name:
+                return None
+            if copy_query and (len(query.question) != 1
+                               or query.question[0].rdtype != self.question.rdtype
+                               or query.question[0].rdclass != self.question.rdclass):
+                return None
+        elif copy_query and query.question:
+            return None
+
+        edns = query.edns
+        wire = bytearray(self.wire_edns if edns >= 0 else self.wire)
+        struct.pack_into('!H', wire, 0, query.id if copy_id else self.id)
+        if self.question is not None:  # letter-case of QNAME from query
+            wire[12:self.qname_end] = query.question[0].name.to_wire()  # type: ignore
+        if edns >= 0:
+            self.OPT_TTL.pack_into(wire, self.opt_offset + 5,
+                                   self.ext_rcode | edns << 16 | query.ednsflags & 0xFFFF)
+        return bytes(wire)
+
+
 class DNSReply(DNSMessage):
     def __init__(
                 self,
                 message: dns.message.Message,
                 query: Optional[dns.message.Message] = None,
                 copy_id: bool = False,
-                copy_query: bool = False
+                copy_query: bool = False,
+                template: Optional[ReplyTemplate] = None
             ) -> None:
         super().__init__(message)
+        self.wire = None  # type: Optional[bytes]
+        self.template = template
         if copy_id or copy_query:
             if query is None:
                 raise ValueError("query must be provided to adjust copy_id/copy_query")
             self.adjust_reply(query, copy_id, copy_query)
 
+    def __getattr__(self, name):
+        # Reply adjusted in wire format is parsed only if needed, e.g. for logging
+        if name == 'message' and self.__dict__.get('wire') is not None:
+            self.message = dns.message.from_wire(self.wire, one_rr_per_rrset=True)
+            return self.message
+        raise AttributeError(name)
+
     def adjust_reply(
                 self,
                 query: dns.message.Message,
                 copy_id: bool = True,
                 copy_query: bool = True
             ) -> None:
+        if self.template is not None:
+            wire = self.template.adjust(query, copy_id, copy_query)
+            if wire is not None:
+                self.wire = wire
+                del self.message
+                return
         answer = dns.message.from_wire(self.message.to_wire(),
                                        xfr=self.message.xfr,
                                        one_rr_per_rrset=True)
@@ -92,6 +202,11 @@ class DNSReply(DNSMessage):
         assert len(answer.additional) == len(self.message.additional)
         self.message = answer
 
+    def to_wire(self) -> bytes:
+        if self.wire is not None:
+            return self.wire
+        return super().to_wire()
+
 
 class DNSReplyRaw(DNSBlob):
     def __init__(
@@ -145,22 +260,21 @@ class Entry:
     default_cls = 'IN'
     default_rc = 'NOERROR'
 
+    # Attributes built on first use, see materialize()
+    lazy_attributes = ('message', 'raw_data', 'sections', 'reply_template', 'matchers')
+
     def __init__(self, node):
-        """ Initialize data entry. """
+        """ Initialize data entry, message and RAW payload are built on first use. """
         self.node = node
         self.origin = '.'
-        self.message = dns.message.Message()
-        self.message.use_edns(edns=0, payload=4096)
         self.fired = 0
+        # Lazily built attributes, shared with fresh copies of the entry
+        self._lazy = {}
 
-        # RAW
-        self.raw_data = self.process_raw()
-
-        # MATCH
+        # MATCH, only field names are stored, predicates are compiled on first use
         self.match_fields = self.process_match()
-
-        # FLAGS (old alias REPLY)
-        self.process_reply_line()
+        if self.match_fields is not None:
+            pydnstest.matchpart.check_fields(self.match_fields)
 
         # ADJUST
         self.adjust_fields = {m.value for m in node.match("/adjust")}
@@ -171,11 +285,54 @@ class Entry:
         except (KeyError, IndexError):
             self.mandatory = None
 
-        # TSIG
-        self.process_tsig()
+        # DELAY
+        self.delay = parse_delay(node)
+
+    def __getattr__(self, name):
+        if name in self.lazy_attributes and '_lazy' in self.__dict__:
+            if name == 'matchers' and name not in self._lazy:
+                self._lazy[name] = None
+                if self.match_fields is not None:
+                    self._lazy[name] = pydnstest.matchpart.compile_matchers(self.match_fields)
+            if name == 'reply_template' and name not in self._lazy:
+                try:
+                    self._lazy[name] = ReplyTemplate(self.message)
+                except ValueError:
+                    self._lazy[name] = None
+            if name not in self._lazy:
+                self.materialize()
+            return self._lazy[name]
+        raise AttributeError(name)
+
+    def materialize(self):
+        """ Build message (including TSIG) and RAW payload if not built yet. """
+        lazy = self._lazy
+        if 'message' in lazy:
+            return
+        try:
+            lazy['message'] = dns.message.Message()
+            self.message.use_edns(edns=0, payload=4096)
 
-        # SECTIONS & RECORDS
-        self.sections = self.process_sections()
+            # RAW
+            lazy['raw_data'] = self.process_raw()
+
+            # FLAGS (old alias REPLY)
+            self.process_reply_line()
+
+            # SECTIONS & RECORDS
+            lazy['sections'] = self.process_sections()
+
+            # TSIG
+            self.process_tsig()
+        except Exception as ex:
+            lazy.pop('message', None)
+            raise ValueError(f'{node_file(self.node)}: entry at {self.node.span}: {ex}') from ex
+
+    def fresh_copy(self):
+        """ Return shallow copy of the entry with reset run-time state. """
+        entry = copy.copy(self)
+        entry.fired = 0
+        return entry
 
     def process_raw(self):
         try:
@@ -231,27 +388,10 @@ class Entry:
             section_name = os.path.basename(section.path)
             sections.add(section_name)
             for record in section.match("/record"):
-                owner = record['/domain'].value
-                if not owner.endswith("."):
-                    owner += self.origin
                 try:
-                    ttl = dns.ttl.from_text(record['/ttl'].value)
-                except KeyError:
-                    ttl = self.default_ttl
-                try:
-                    rdclass = dns.rdataclass.from_text(record['/class'].value)
-                except KeyError:
-                    rdclass = dns.rdataclass.from_text(self.default_cls)
-                rdtype = dns.rdatatype.from_text(record['/type'].value)
-                rr = dns.rrset.from_text(owner, ttl, rdclass, rdtype)
-                if section_name != "question":
-                    rd = record['/data'].value.split()
-                    if rd:
-                        if rdtype == dns.rdatatype.DS:
-                            rd[1] = f'{dns.dnssec.algorithm_from_text(rd[1])}'
-                        rd = dns.rdata.from_text(rr.rdclass, rr.rdtype, ' '.join(
-                            rd), origin=dns.name.from_text(self.origin), relativize=False)
-                    rr.add(rd)
+                    rr = self.process_record(record, section_name)
+                except Exception as ex:
+                    raise ValueError(f'record at {record.span}: {ex}') from ex
                 if section_name == 'question':
                     if rr.rdtype == dns.rdatatype.AXFR:
                         self.message.xfr = True
@@ -264,6 +404,30 @@ class Entry:
                     self.message.additional.append(rr)
         return sections
 
+    def process_record(self, record, section_name):
+        owner = record['/domain'].value
+        if not owner.endswith("."):
+            owner += self.origin
+        try:
+            ttl = dns.ttl.from_text(record['/ttl'].value)
+        except KeyError:
+            ttl = self.default_ttl
+        try:
+            rdclass = dns.rdataclass.from_text(record['/class'].value)
+        except KeyError:
+            rdclass = dns.rdataclass.from_text(self.default_cls)
+        rdtype = dns.rdatatype.from_text(record['/type'].value)
+        rr = dns.rrset.from_text(owner, ttl, rdclass, rdtype)
+        if section_name != "question":
+            rd = record['/data'].value.split()
+            if rd:
+                if rdtype == dns.rdatatype.DS:
+                    rd[1] = f'{dns.dnssec.algorithm_from_text(rd[1])}'
+                rd = dns.rdata.from_text(rr.rdclass, rr.rdtype, ' '.join(
+                    rd), origin=dns.name.from_text(self.origin), relativize=False)
+            rr.add(rd)
+        return rr
+
     def __str__(self):
         txt = 'ENTRY_BEGIN\n'
 
@@ -349,6 +513,28 @@ class Entry:
             return None
         return opcodes[0]
 
+    def index_key(self):
+        """
+        Return (qname, qtype) key of entry question, taken directly from the parsed tree.
+
+        Raises KeyError if the entry can match queries with different qname or qtype.
+        """
+        if self.match_fields is None or not {'qname', 'qtype'} <= self.match_fields:
+            raise KeyError('entry does not match both qname and qtype')
+        records = list(self.node.match("/section/question/record"))
+        if not records:
+            return None
+        if len(records) > 1:
+            raise KeyError('entry with more than one question')
+        owner = records[0]['/domain'].value
+        if not owner.endswith("."):
+            owner += self.origin
+        return dns.name.from_text(owner), dns.rdatatype.from_text(records[0]['/type'].value)
+
+    def matches(self, msg) -> bool:
+        """ Return True if scripted reply matches given message, see match() for diagnostics. """
+        return pydnstest.matchpart.matches(self.message, msg, self.matchers)
+
     def match(self, msg):
         """ Compare scripted reply to given message based on match criteria. """
         for code in self.match_fields:
@@ -376,10 +562,14 @@ class Entry:
         if self.raw_data is not None:
             raw_id = 'raw_id' in self.adjust_fields
             assert self.raw_data is not None
-            return DNSReplyRaw(self.raw_data, query, raw_id)
-        copy_id = 'copy_id' in self.adjust_fields
-        copy_query = 'copy_query' in self.adjust_fields
-        return DNSReply(self.message, query, copy_id, copy_query)
+            reply = DNSReplyRaw(self.raw_data, query, raw_id)  # type: DNSBlob
+        else:
+            copy_id = 'copy_id' in self.adjust_fields
+            copy_query = 'copy_query' in self.adjust_fields
+            reply = DNSReply(self.message, query, copy_id, copy_query, self.reply_template)
+        if self.delay is not None:
+            reply.delay = sample_delay(self.delay)
+        return reply
 
     def set_edns(self, fields):
         """ Set EDNS version and bufsize. """
@@ -430,10 +620,26 @@ class Range:
         self.addresses = {address} if address is not None else set()
         self.addresses |= {a.value for a in node.match("/address/*")}
         self.stored = [Entry(n) for n in node.match("/entry")]
+        self.index, self.unindexed = self.build_index(self.stored)
         self.args = {}
+        try:
+            self.args['LOSS'] = float(node["/loss"].value)
+        except KeyError:
+            pass
+        # Delay of replies from entries without their own DELAY
+        self.delay = parse_delay(node)
         self.received = 0
         self.sent = 0
 
+    def fresh_copy(self):
+        """ Return copy of the range with reset run-time state, parsed data are shared. """
+        rng = copy.copy(self)
+        rng.stored = [entry.fresh_copy() for entry in self.stored]
+        rng.args = dict(self.args)
+        rng.received = 0
+        rng.sent = 0
+        return rng
+
     def __del__(self):
         self.log.info('[ RANGE %d-%d ] %s received: %d sent: %d',
                       self.a, self.b, self.addresses, self.received, self.sent)
@@ -449,6 +655,30 @@ class Range:
         txt += 'RANGE_END\n\n'
         return txt
 
+    @staticmethod
+    def build_index(entries):
+        """
+        Index entries by (qname, qtype) of their question.
+
+        Returns {key: [entry position]} and list of positions of entries which cannot
+        be indexed (e.g. entries using "subdomain" match instead of "qname").
+        """
+        index = {}
+        unindexed = []
+        for position, entry in enumerate(entries):
+            try:
+                index.setdefault(entry.index_key(), []).append(position)
+            except KeyError:
+                unindexed.append(position)
+        return index, unindexed
+
+    def candidates(self, query):
+        """ Return entries which may match the query, in the order they are defined. """
+        positions = self.index.get(question_key(query), [])
+        if self.unindexed:
+            positions = heapq.merge(positions, self.unindexed)
+        return [self.stored[position] for position in positions]
+
     def eligible(self, ident, address):
         """ Return true if this range is eligible for fetching reply. """
         if self.a <= ident <= self.b:
@@ -460,19 +690,22 @@ class Range:
     def reply(self, query: dns.message.Message) -> Optional[DNSBlob]:
         """Get answer for given query (adjusted if needed)."""
         self.received += 1
-        for candidate in self.stored:
+        for candidate in self.candidates(query):
+            if not candidate.matches(query):
+                continue
             try:
-                candidate.match(query)
                 resp = candidate.reply(query)
-                # Probabilistic loss
-                if 'LOSS' in self.args:
-                    if random.random() < float(self.args['LOSS']):
-                        return DNSReplyServfail(query)
-                self.sent += 1
-                candidate.fired += 1
-                return resp
             except ValueError:
-                pass
+                continue
+            # Probabilistic loss, the query is silently dropped
+            if 'LOSS' in self.args:
+                if random.random() < float(self.args['LOSS']):
+                    return None
+            if resp is not None and self.delay is not None and candidate.delay is None:
+                resp.delay = sample_delay(self.delay)
+            self.sent += 1
+            candidate.fired += 1
+            return resp
         return DNSReplyServfail(query)
 
 
@@ -489,13 +722,15 @@ class Step:
     Step represents one scripted action in a given moment,
     each step has an order identifier, type and optionally data entry.
     """
-    require_data = ['QUERY', 'CHECK_ANSWER', 'REPLY']
+    batch_types = ('QUERY_BATCH', 'QUERY_BATCH TCP')
+    require_data = ['QUERY', *batch_types, 'CHECK_ANSWER', 'REPLY']
 
     def __init__(self, node):
         """ Initialize single scenario step. """
         self.node = node
         self.id = int(node.value)
-        self.type = node["/type"].value
+        # Both parsers keep whitespace between words of the type as written
+        self.type = ' '.join(node["/type"].value.split())
         self.log = StepLogger(logging.getLogger('pydnstest.scenario.Step'),
                               {'id': self.id, 'type': self.type})
         try:
@@ -503,14 +738,39 @@ class Step:
         except KeyError:
             pass
         self.data = [Entry(n) for n in node.match("/entry")]
+        # Number of copies of each query of QUERY_BATCH
+        self.batch_copies = None
+        if self.type in self.batch_types:
+            self.batch_copies = getattr(self, 'delay', 1)
+            if not self.data or self.batch_copies < 1:
+                raise ValueError(f'{node_file(node)}: {self.type} step {self.id} at {node.span} '
+                                 'requires at least one ENTRY and at least one copy')
+        # Index of QUERY_BATCH query checked by CHECK_ANSWER, set by Scenario
+        self.batch_index = None
         self.queries = []
         self.has_data = self.type in Step.require_data
         self.answer = None
         self.raw_answer = None
+        # QUERY_BATCH results, answers and RTTs are in order of sent queries
+        self.answers = []
+        self.rtts = []
+        self.upstream_queries = 0
         self.repeat_if_fail = 0
         self.pause_if_fail = 0
         self.next_if_fail = -1
 
+    def fresh_copy(self):
+        """ Return copy of the step with reset run-time state, parsed data are shared. """
+        step = copy.copy(self)
+        step.data = [entry.fresh_copy() for entry in self.data]
+        step.queries = []
+        step.answer = None
+        step.raw_answer = None
+        step.answers = []
+        step.rtts = []
+        step.upstream_queries = 0
+        return step
+
     def __str__(self):
         txt = f'\nSTEP {self.id} {self.type}'
         if self.repeat_if_fail:
@@ -538,6 +798,9 @@ class Step:
             # Parse QUERY-specific parameters
             choice, tcp, src_address = None, False, ctx.deckard_address
             return self.__query(ctx, tcp=tcp, choice=choice, src_address=src_address)
+        elif self.type in self.batch_types:
+            self.log.info('')
+            return self.__query_batch(ctx, tcp=self.type.endswith('TCP'))
         elif self.type == 'CHECK_OUT_QUERY':  # ignore
             self.log.info('')
             return None
@@ -558,7 +821,9 @@ class Step:
         if not self.data:
             raise ValueError("response definition required")
         expected = self.data[0]
-        if expected.raw_data is not None:
+        if self.batch_index is not None:
+            self.__check_batch_answer(ctx, self.batch_index)
+        elif expected.raw_data is not None:
             self.log.debug("raw answer: %s", ctx.last_raw_answer.to_text())
             expected.cmp_raw(ctx.last_raw_answer)
         else:
@@ -567,6 +832,69 @@ class Step:
             self.log.debug("answer: %s", ctx.last_answer.to_text())
             expected.match(ctx.last_answer)
 
+    def __check_batch_answer(self, ctx, index):
+        """ Compare answers to all copies of index-th query (from 1) of preceding QUERY_BATCH. """
+        if ctx.last_batch is None:
+            raise ValueError("no answers from preceding QUERY_BATCH")
+        answers = ctx.last_batch.batch_answers(index)
+        if not answers:
+            raise ValueError(f"QUERY_BATCH step {ctx.last_batch.id} has no query {index}")
+        for answer in answers:
+            self.log.debug("answer: %s", answer.to_text())
+            self.data[0].match(answer)
+
+    def batch_answers(self, index):
+        """ Return answers to all copies of index-th query (from 1) of this QUERY_BATCH step. """
+        copies = self.batch_copies
+        return self.answers[(index - 1) * copies:index * copies] if index > 0 else []
+
+    def __query_batch(self, ctx, tcp=False):
+        """
+        Send all queries at once and wait for all answers.
+
+        Each query is sent the number of times given after the step type (default once),
+        copies are spread over client source addresses. Queries from each source address
+        are sent concurrently, answers and their RTTs are stored in order of the queries.
+        """
+        copies = self.batch_copies
+        queries = []
+        for entry in self.data:
+            if entry.raw_data is not None:
+                raise ValueError(f'step {self.id:03} RAW queries are not supported')
+            queries.extend([entry.message.to_wire()] * copies)
+        sources = ctx.client_addresses or [ctx.deckard_address]
+        target = ctx.client[list(ctx.client.keys())[0]]
+        groups = {}  # type: Dict[Optional[str], List[int]]
+        for position in range(len(queries)):
+            groups.setdefault(sources[position % len(sources)], []).append(position)
+        upstream = sum(int(rng.received) for rng in ctx.ranges)
+
+        def exchange(src_address, positions):
+            timestamps = []  # type: List[float]
+            tstart = time.monotonic()
+            answers = ctx.client_pool.exchange(target[0], target[1],
+                                               [queries[pos] for pos in positions],
+                                               tcp=tcp, src_address=src_address,
+                                               timestamps=timestamps)
+            return positions, answers, tstart, timestamps
+
+        self.answers = [None] * len(queries)
+        self.rtts = [0.0] * len(queries)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            for positions, answers, tstart, timestamps in executor.map(lambda g: exchange(*g),
+                                                                       groups.items()):
+                for position, answer, received in zip(positions, answers, timestamps):
+                    self.answers[position] = dns.message.from_wire(answer, one_rr_per_rrset=True)
+                    self.rtts[position] = (received - tstart) * 1000
+                    ctx.timing.add_query(tstart, received, len(queries[position]), len(answer))
+
+        self.upstream_queries = sum(int(rng.received) for rng in ctx.ranges) - upstream
+        self.log.info('%d queries from %d addresses, max RTT %.1f ms, %d upstream queries',
+                      len(queries), len(groups), max(self.rtts), self.upstream_queries)
+        ctx.last_batch = self
+        ctx.last_answer = None
+        ctx.last_raw_answer = None
+
     def __query(self, ctx, tcp=False, choice=None, src_address=None):
         """
         Send query and wait for an answer (if the query is not RAW).
@@ -585,24 +913,18 @@ class Step:
         if choice not in ctx.client:
             raise ValueError(f'step {self.id:03} invalid QUERY target: {choice}')
 
-        tstart = datetime.now()
+        tstart = time.monotonic()
 
         # Send query and wait for answer
         answer = None
-        sock = pydnstest.mock_client.setup_socket(ctx.client[choice][0],
-                                                  ctx.client[choice][1],
-                                                  tcp,
-                                                  src_address=src_address)
-        with sock:
-            pydnstest.mock_client.send_query(sock, data_to_wire)
-            if self.data[0].raw_data is None:
-                answer = pydnstest.mock_client.get_answer(sock)
-
-        # Track RTT
-        rtt = (datetime.now() - tstart).total_seconds() * 1000
-        global g_rtt, g_nqueries
-        g_nqueries += 1
-        g_rtt += rtt
+        answers = ctx.client_pool.exchange(ctx.client[choice][0], ctx.client[choice][1],
+                                           [data_to_wire], tcp=tcp, src_address=src_address,
+                                           expect_answers=self.data[0].raw_data is None)
+        if answers is not None:
+            answer = answers[0]
+
+        ctx.timing.add_query(tstart, time.monotonic() if answer is not None else None,
+                             len(data_to_wire), len(answer) if answer is not None else 0)
 
         # Remember last answer for checking later
         self.raw_answer = answer
@@ -639,9 +961,102 @@ class Scenario:
         self.current_range = None
         self.steps = [Step(n) for n in node.match("/step")]
         self.current_step = None
+        # Index of current step shared with test server workers, see pydnstest.sharedstate
+        self.shared_step = None
         self.client = {}
+        # Client sockets reused by steps while playing, see pydnstest.mock_client.ClientPool
+        self.client_pool = None
+        self.keep_tcp = False
+        # Reason to stop playing set from another thread, see abort()
+        self.abort_reason = None
+        # Source addresses of QUERY_BATCH steps, deckard_address is used if empty
+        self.client_addresses = []
+        self.last_batch = None
+        self.timing = pydnstest.timing.TimingRecorder()
         self.deckard_address = deckard_address
 
+        # Indexes for reply(), they refer to ranges and steps by position
+        # so they are valid for fresh copies of the scenario as well
+        self.all_addresses = frozenset().union(*(rng.addresses for rng in self.ranges))
+        self.range_starts, self.eligible_ranges = self.build_range_index()
+        self.reply_steps = [i for i, step in enumerate(self.steps) if step.type == 'REPLY']
+        self.index_batch_checks()
+        self.reply_step_ids = [self.steps[i].id for i in self.reply_steps]
+        if self.reply_step_ids != sorted(self.reply_step_ids):
+            self.reply_step_ids = None  # steps out of order, lookup scans all REPLY steps
+
+    def index_batch_checks(self):
+        """
+        Set batch_index of CHECK_ANSWER steps with a number which follow QUERY_BATCH.
+
+        The number selects a query of the batch, numbers after other CHECK_ANSWER steps
+        are ignored as they always were.
+        """
+        last_query = None
+        for step in self.steps:
+            if step.type == 'QUERY' or step.type in Step.batch_types:
+                last_query = step
+            elif (step.type == 'CHECK_ANSWER' and hasattr(step, 'delay')
+                  and last_query is not None and last_query.type in Step.batch_types):
+                step.batch_index = step.delay
+
+    def build_range_index(self):
+        """
+        Precompute ranges eligible for fetching reply in each interval of step IDs.
+
+        Returns sorted list of interval starts and for each interval {address: range position}
+        with position of the first eligible range; key None selects the first range covering
+        the interval regardless of its addresses.
+        """
+        starts = sorted({rng.a for rng in self.ranges} | {rng.b + 1 for rng in self.ranges})
+        eligible = []
+        for start in starts:
+            first = {}  # type: Dict[Optional[str], int]
+            for position, rng in enumerate(self.ranges):
+                if not rng.a <= start <= rng.b:
+                    continue
+                first.setdefault(None, position)
+                for address in self.all_addresses:
+                    if not rng.addresses or address in rng.addresses:
+                        first.setdefault(address, position)
+            eligible.append(first)
+        return starts, eligible
+
+    def eligible_range(self, ident, address):
+        """ Return the first range eligible for fetching reply, see Range.eligible(). """
+        interval = bisect.bisect_right(self.range_starts, ident) - 1
+        if interval < 0:
+            return None
+        position = self.eligible_ranges[interval].get(address)
+        if position is None:
+            return None
+        return self.ranges[position]
+
+    def fresh_copy(self, deckard_address=None):
+        """ Return copy of the scenario with reset run-time state, parsed data are shared. """
+        scenario = copy.copy(self)
+        scenario.ranges = [rng.fresh_copy() for rng in self.ranges]
+        scenario.current_range = None
+        scenario.steps = [step.fresh_copy() for step in self.steps]
+        scenario.current_step = None
+        scenario.shared_step = None
+        scenario.client = {}
+        scenario.client_pool = None
+        scenario.abort_reason = None
+        scenario.last_batch = None
+        scenario.timing = pydnstest.timing.TimingRecorder()
+        scenario.deckard_address = deckard_address
+        return scenario
+
+    def materialize(self):
+        """ Build messages of all entries now, so errors in any of them are reported at once. """
+        for rng in self.ranges:
+            for entry in rng.stored:
+                entry.materialize()
+        for step in self.steps:
+            for entry in step.data:
+                entry.materialize()
+
     def __str__(self):
         txt = 'SCENARIO_BEGIN'
         if self.info:
@@ -654,34 +1069,55 @@ class Scenario:
         txt += "\nSCENARIO_END"
         return txt
 
+    def set_current_step(self, index):
+        """ Make index-th step current, also for test server workers. Returns the step. """
+        self.current_step = self.steps[index]
+        if self.shared_step is not None:
+            self.shared_step.value = index
+        return self.current_step
+
     def reply(self, query: dns.message.Message, address=None) -> Optional[DNSBlob]:
         """Generate answer packet for given query."""
+        if self.shared_step is not None and self.shared_step.value >= 0:
+            # current step is set by set_current_step() in parent
+            self.current_step = self.steps[self.shared_step.value]
         current_step_id = self.current_step.id
         # Unknown address, select any match
         # TODO: workaround until the server supports stub zones
-        all_addresses = set()  # type: ignore
-        for rng in self.ranges:
-            all_addresses.update(rng.addresses)
-        if address not in all_addresses:
+        if address not in self.all_addresses:
             address = None
         # Find current valid query response range
-        for rng in self.ranges:
-            if rng.eligible(current_step_id, address):
-                self.current_range = rng
-                return rng.reply(query)
+        rng = self.eligible_range(current_step_id, address)
+        if rng is not None:
+            self.current_range = rng
+            return rng.reply(query)
         # Find any prescripted one-shot replies
-        for step in self.steps:
-            if step.id < current_step_id or step.type != 'REPLY':
+        first = 0
+        if self.reply_step_ids is not None:
+            first = bisect.bisect_left(self.reply_step_ids, current_step_id)
+        for position in self.reply_steps[first:]:
+            step = self.steps[position]
+            if step.id < current_step_id:
                 continue
             try:
                 candidate = step.data[0]
-                candidate.match(query)
-                step.data.remove(candidate)
+            except IndexError:  # all entries used
+                continue
+            if not candidate.matches(query):
+                continue
+            try:
+                step.data.remove(candidate)  # fails if used concurrently by another worker
                 return candidate.reply(query)
-            except (IndexError, ValueError):
+            except ValueError:
                 pass
         return DNSReplyServfail(query)
 
+    def abort(self, reason):
+        """ Fail the step being played and stop playing, e.g. when binary under test died. """
+        self.abort_reason = reason
+        if self.client_pool is not None:
+            self.client_pool.abort(reason)
+
     def play(self, paddr):
         """ Play given scenario. """
         # Store test subject => address mapping
@@ -689,38 +1125,42 @@ class Scenario:
 
         step = None
         i = 0
-        while i < len(self.steps):
-            step = self.steps[i]
-            self.current_step = step
-            try:
-                step.play(self)
-            except ValueError as ex:
-                if step.repeat_if_fail > 0:
-                    self.log.info("[play] step %d: exception - '%s', retrying step %d (%d left)",
-                                  step.id, ex, step.next_if_fail, step.repeat_if_fail)
-                    step.repeat_if_fail -= 1
-                    if step.pause_if_fail > 0:
-                        time.sleep(step.pause_if_fail)
-                    if step.next_if_fail != -1:
-                        next_steps = [j for j in range(len(self.steps)) if self.steps[
-                            j].id == step.next_if_fail]
-                        if not next_steps:
-                            raise ValueError(
-                                f'step {step.id}: '
-                                f'wrong NEXT value "{step.next_if_fail}"'
-                            ) from ex
-                        next_step = next_steps[0]
-                        if next_step < len(self.steps):
-                            i = next_step
-                        else:
-                            raise ValueError(
-                                f'step {step.id}: '
-                                f'Can\'t branch to NEXT value "{step.next_if_fail}"'
-                            ) from ex
-                    continue
-                ex_details = ex if self.log.isEnabledFor(logging.DEBUG) else None
-                raise ValueError(f'{self.file} step {step.id} {ex}') from ex_details
-            i += 1
+        with pydnstest.mock_client.ClientPool(keep_tcp=self.keep_tcp) as self.client_pool:
+            while i < len(self.steps):
+                step = self.set_current_step(i)
+                try:
+                    if self.abort_reason is not None:
+                        raise ValueError(self.abort_reason)
+                    with self.timing.record_step(step):
+                        step.play(self)
+                except ValueError as ex:
+                    if step.repeat_if_fail > 0 and self.abort_reason is None:
+                        self.log.info(
+                            "[play] step %d: exception - '%s', retrying step %d (%d left)",
+                            step.id, ex, step.next_if_fail, step.repeat_if_fail)
+                        step.repeat_if_fail -= 1
+                        if step.pause_if_fail > 0:
+                            time.sleep(step.pause_if_fail)
+                        if step.next_if_fail != -1:
+                            next_steps = [j for j in range(len(self.steps)) if self.steps[
+                                j].id == step.next_if_fail]
+                            if not next_steps:
+                                raise ValueError(
+                                    f'step {step.id}: '
+                                    f'wrong NEXT value "{step.next_if_fail}"'
+                                ) from ex
+                            next_step = next_steps[0]
+                            if next_step < len(self.steps):
+                                i = next_step
+                            else:
+                                raise ValueError(
+                                    f'step {step.id}: '
+                                    f'Can\'t branch to NEXT value "{step.next_if_fail}"'
+                                ) from ex
+                        continue
+                    ex_details = ex if self.log.isEnabledFor(logging.DEBUG) else None
+                    raise ValueError(f'{self.file} step {step.id} {ex}') from ex_details
+                i += 1
 
         for r in self.ranges:
             for e in r.stored:
@@ -878,12 +1318,43 @@ def parse_config(scn_cfg, qmin, installdir):  # FIXME: pylint: disable=too-many-
     return ctx
 
 
-def parse_file(path, deckard_address=None):
-    """ Parse scenario from a file. """
+PARSERS = ('native', 'augeas', 'crosscheck')
+
 
-    aug = pydnstest.augwrap.AugeasWrapper(
+def load_augeas_tree(path):
+    """ Parse scenario file using Augeas lens deckard.aug. """
+    # python-augeas is required only when the Augeas parser is selected
+    from pydnstest import augwrap  # pylint: disable=import-outside-toplevel
+
+    aug = augwrap.AugeasWrapper(
         confpath=path, lens='Deckard', loadpath=os.path.dirname(__file__))
-    node = aug.tree
+    return aug.tree
+
+
+def load_tree(path, parser=None):
+    """
+    Parse scenario file into tree of nodes.
+
+    Parser is one of PARSERS, default is taken from DECKARD_PARSER environment variable
+    and falls back to the native parser. 'crosscheck' uses the native parser
+    and verifies its output against the Augeas parser.
+    """
+    if parser is None:
+        parser = os.environ.get('DECKARD_PARSER', 'native')
+    if parser == 'native':
+        return pydnstest.rplparser.parse_file(path)
+    elif parser == 'augeas':
+        return load_augeas_tree(path)
+    elif parser == 'crosscheck':
+        node = pydnstest.rplparser.parse_file(path)
+        pydnstest.rplparser.compare_trees(load_augeas_tree(path), node)
+        return node
+    else:
+        raise NotImplementedError(f'unsupported scenario parser "{parser}", use one of {PARSERS}')
+
+
+def parse_tree(node, deckard_address=None):
+    """ Create scenario and config from a parsed tree. """
     config = []
     for line in [c.value for c in node.match("/config/*")]:
         if line:
@@ -897,3 +1368,8 @@ def parse_file(path, deckard_address=None):
                     config.append(kv)
     scenario = Scenario(node["/scenario"], os.path.basename(node.path), deckard_address)
     return scenario, config
+
+
+def parse_file(path, deckard_address=None, parser=None):
+    """ Parse scenario from a file. """
+    return parse_tree(load_tree(path, parser), deckard_address)
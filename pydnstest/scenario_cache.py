@@ -0,0 +1,41 @@
+"""
+Caching of parsed scenarios
+
+Parsed scenarios are cached in memory for the whole process (see parse_file_cached()),
+so a scenario run repeatedly (e.g. with and without query minimization or with several
+configurations) is parsed only once.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Tuple  # noqa
+
+from pydnstest.scenario import Scenario, parse_file  # noqa
+
+# Parsed scenarios shared by all runs in this process, see parse_file_cached()
+# {path: ((mtime, content hash), scenario, config)}
+SCENARIO_CACHE = {}  # type: Dict[str, Tuple[Tuple[int, bytes], Scenario, List[List[str]]]]
+
+
+def parse_file_cached(path, deckard_address=None):
+    """
+    Parse scenario from a file, reuse result of previous parse of the same file.
+
+    Cache entry is valid as long as file modification time and content hash match.
+    Messages of all entries are built when the file is parsed, so malformed records
+    are reported before the scenario is played.
+    Each call returns fresh copy of run-time state (fired entries, REPLY steps etc.)
+    so the scenario can be played repeatedly.
+    """
+    with open(path, 'rb') as rpl_file:
+        version = (os.fstat(rpl_file.fileno()).st_mtime_ns,
+                   hashlib.sha256(rpl_file.read()).digest())
+    try:
+        cached_version, scenario, config = SCENARIO_CACHE[path]
+        if cached_version != version:
+            raise KeyError(path)
+    except KeyError:
+        scenario, config = parse_file(path)
+        scenario.materialize()
+        SCENARIO_CACHE[path] = (version, scenario, config)
+    return scenario.fresh_copy(deckard_address), [list(kv) for kv in config]
@@ -0,0 +1,95 @@
+"""Run-time scenario state shared between test server worker processes"""
+
+import functools
+import multiprocessing
+
+# Worker processes are forked, shared memory is inherited from the parent
+CONTEXT = multiprocessing.get_context('fork')
+
+
+@functools.total_ordering
+class SharedCounter:
+    """
+    Integer counter in shared memory, drop-in replacement for int counters
+    like Entry.fired, Range.received or Range.sent (supports +=, comparison, truth value and %d).
+    """
+
+    def __init__(self, value=0):
+        self.value = CONTEXT.Value('q', value)
+
+    def __iadd__(self, other):
+        with self.value.get_lock():
+            self.value.value += other
+        return self
+
+    def __int__(self):
+        return self.value.value
+
+    __index__ = __int__
+
+    def __bool__(self):
+        return int(self) != 0
+
+    def __eq__(self, other):
+        return int(self) == other
+
+    def __lt__(self, other):
+        return int(self) < other
+
+    def __hash__(self):
+        return hash(int(self))
+
+    def __repr__(self):
+        return repr(int(self))
+
+
+class SharedEntries(list):
+    """
+    Entries of REPLY step which can be consumed only once across all worker processes.
+
+    Consumed entries are tracked by shared index, the list itself is never modified.
+    """
+
+    def __init__(self, entries):
+        super().__init__(entries)
+        self.consumed = CONTEXT.Value('i', 0)
+
+    def __len__(self):
+        return super().__len__() - self.consumed.value
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise IndexError('only the first unused entry is accessible')
+        consumed = self.consumed.value
+        if consumed >= super().__len__():
+            raise IndexError('all entries were used')
+        return super().__getitem__(consumed)
+
+    def remove(self, value):
+        """ Mark the first unused entry as used, raise ValueError if it is not `value`. """
+        with self.consumed.get_lock():
+            consumed = self.consumed.value
+            if consumed >= super().__len__() or super().__getitem__(consumed) is not value:
+                raise ValueError('entry was used by another worker')
+            self.consumed.value += 1
+
+
+def share_scenario_state(scenario):
+    """
+    Move run-time state of the scenario to shared memory before forking worker processes.
+
+    Afterwards hits of entries and ranges are counted across all processes, each REPLY step
+    entry is used only once and current step set by Scenario.play() is visible to workers.
+    """
+    for rng in scenario.ranges:
+        rng.received = SharedCounter(rng.received)
+        rng.sent = SharedCounter(rng.sent)
+        for entry in rng.stored:
+            entry.fired = SharedCounter(entry.fired)
+    for step in scenario.steps:
+        if step.type == 'REPLY':
+            step.data = SharedEntries(step.data)
+    scenario.shared_step = CONTEXT.Value('i', -1)
@@ -0,0 +1,163 @@
+"""Supervision of binaries under test: detection of their death and their shutdown
+
+Daemons are dicts with subprocess.Popen object under key 'proc' and program configuration
+under key 'cfg', as returned by deckard.setup_daemons().
+"""
+
+import contextlib
+import logging
+import os
+import selectors
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional  # noqa
+
+# seconds between SIGTERM and SIGKILL, configurable by grace_period key of program configuration
+DEFAULT_GRACE_PERIOD = 5
+# seconds between checks of processes which cannot be watched through pidfd
+POLL_INTERVAL = 0.05
+
+
+def pidfd_open(pid: int) -> Optional[int]:
+    """ Return file descriptor readable when the process exits, None if not supported """
+    try:
+        return os.pidfd_open(pid)  # type: ignore
+    except (AttributeError, OSError):  # Python < 3.9, Linux < 5.3, process already reaped
+        return None
+
+
+def record_exit(daemon: Dict) -> None:
+    """ Store exit code or name of the signal which terminated the exited daemon """
+    returncode = daemon['proc'].returncode
+    daemon['exit_code'] = returncode if returncode >= 0 else None
+    daemon['exit_signal'] = None
+    if returncode < 0:
+        try:
+            daemon['exit_signal'] = signal.Signals(-returncode).name
+        except ValueError:
+            daemon['exit_signal'] = f'signal {-returncode}'
+
+
+def describe_exit(daemon: Dict) -> str:
+    record_exit(daemon)
+    name = daemon['cfg']['name']
+    if daemon['exit_signal'] is None:
+        msg = f'process {name} terminated with return code {daemon["exit_code"]}'
+    else:
+        msg = f'process {name} terminated by signal {daemon["exit_signal"]}'
+    if daemon.get('killed'):
+        msg += ' after it did not exit within its grace period'
+    return msg
+
+
+class Supervisor:
+    """
+    Context manager watching daemons in a background thread.
+
+    on_exit(daemon) is called from the thread as soon as a daemon exits.
+    """
+
+    def __init__(self, daemons: List[Dict], on_exit: Callable[[Dict], None]) -> None:
+        self.daemons = daemons
+        self.on_exit = on_exit
+        self.wakeup = None  # type: Optional[List[int]]
+        self.thread = None  # type: Optional[threading.Thread]
+
+    def __enter__(self) -> 'Supervisor':
+        self.wakeup = list(os.pipe())
+        self.thread = threading.Thread(target=self.watch, name='supervisor', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        assert self.wakeup is not None and self.thread is not None
+        os.write(self.wakeup[1], b'\0')
+        self.thread.join()
+        for fd in self.wakeup:
+            os.close(fd)
+        self.wakeup = None
+
+    def watch(self) -> None:
+        assert self.wakeup is not None
+        with selectors.DefaultSelector() as selector, contextlib.ExitStack() as stack:
+            selector.register(self.wakeup[0], selectors.EVENT_READ)
+            polled = []
+            for daemon in self.daemons:
+                pidfd = pidfd_open(daemon['proc'].pid)
+                if pidfd is None:
+                    polled.append(daemon)
+                else:
+                    stack.callback(os.close, pidfd)
+                    selector.register(pidfd, selectors.EVENT_READ, daemon)
+            while len(selector.get_map()) > 1 or polled:
+                events = selector.select(POLL_INTERVAL if polled else None)
+                exited = []
+                for key, _ in events:
+                    if key.fd == self.wakeup[0]:
+                        return
+                    selector.unregister(key.fd)
+                    exited.append(key.data)
+                still_polled = []
+                for daemon in polled:
+                    if daemon['proc'].poll() is None:
+                        still_polled.append(daemon)
+                    else:
+                        exited.append(daemon)
+                polled = still_polled
+                for daemon in exited:
+                    daemon['proc'].wait()
+                    record_exit(daemon)
+                    logging.getLogger('deckard.supervisor').error('%s', describe_exit(daemon))
+                    self.on_exit(daemon)
+
+
+def terminate(daemons: List[Dict]) -> None:
+    """
+    Send SIGTERM to all daemons at once and wait until they exit.
+
+    Daemons still running after their grace period get SIGKILL and are marked as killed.
+    Exit status of all daemons is recorded, see record_exit().
+    """
+    log = logging.getLogger('deckard.supervisor')
+    start = time.monotonic()
+    with selectors.DefaultSelector() as selector, contextlib.ExitStack() as stack:
+        running = []
+        polled = False
+        for daemon in daemons:
+            if daemon['proc'].poll() is not None:
+                continue
+            pidfd = pidfd_open(daemon['proc'].pid)
+            if pidfd is None:
+                polled = True
+            else:
+                stack.callback(os.close, pidfd)
+                selector.register(pidfd, selectors.EVENT_READ)
+            daemon['proc'].terminate()
+            running.append(daemon)
+
+        while running:
+            timeout = None  # type: Optional[float]
+            now = time.monotonic()
+            for daemon in running:
+                if daemon.get('killed'):
+                    continue
+                remaining = start + daemon['cfg'].get('grace_period', DEFAULT_GRACE_PERIOD) - now
+                if remaining <= 0:
+                    log.warning('process %s did not exit within its grace period, killing it',
+                                daemon['cfg']['name'])
+                    daemon['proc'].kill()
+                    daemon['killed'] = True
+                elif timeout is None or remaining < timeout:
+                    timeout = remaining
+            if polled:
+                timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+            if timeout is None and not selector.get_map():
+                break  # nothing to wait for, proc.wait() below
+            for key, _ in selector.select(timeout):
+                selector.unregister(key.fd)  # the process exited
+            running = [daemon for daemon in running if daemon['proc'].poll() is None]
+
+    for daemon in daemons:
+        daemon['proc'].wait()
+        record_exit(daemon)
@@ -0,0 +1,73 @@
+""" This is unittest file for loadgen.py """
+
+import asyncio
+import socket
+
+import dns.message
+import dns.rcode
+import dpkt
+
+from pydnstest import loadgen
+
+
+def test_percentile():
+    """Checks nearest-rank percentiles."""
+    values = list(range(1, 1001))
+    assert [loadgen.percentile(values, pct) for pct in loadgen.PERCENTILES] == [500, 900, 990, 999]
+    assert loadgen.percentile([7], 99.9) == 7
+
+
+def test_schedules(tmp_path):
+    """Checks constant rate and sped up trace schedules."""
+    schedule = loadgen.rate_schedule([b'a', b'b'], qps=4, duration=1)
+    assert schedule == [(0, b'a'), (0.25, b'b'), (0.5, b'a'), (0.75, b'b')]
+    trace_file = tmp_path / 'trace.txt'
+    trace_file.write_text('# comment\n10 example.com.\nexample.net. AAAA\n\n12.5 example.org. MX\n')
+    trace = loadgen.read_trace(str(trace_file))
+    assert [dns.message.from_wire(query).question[0].to_text() for _, query in trace] == [
+        'example.com. IN A', 'example.net. IN AAAA', 'example.org. IN MX']
+    assert [offset for offset, _ in loadgen.trace_schedule(trace, speedup=2)] == [0, 0, 1.25]
+
+
+def test_trace_from_pcap(tmp_path):
+    """Checks only DNS queries to port 53 are read from PCAP."""
+    query = dns.message.make_query('example.com.', 'A')
+    response = dns.message.make_response(query)
+    pcap_path = tmp_path / 'trace.pcap'
+    with open(pcap_path, 'wb') as pcap_file:
+        writer = dpkt.pcap.Writer(pcap_file)
+        for timestamp, wire, dport in [(1, query.to_wire(), 53), (2, response.to_wire(), 53),
+                                       (3, query.to_wire(), 5353)]:
+            udp = dpkt.udp.UDP(sport=1234, dport=dport, data=wire)
+            ip = dpkt.ip.IP(src=b'\x7f\0\0\1', dst=b'\x7f\0\0\2', p=dpkt.ip.IP_PROTO_UDP, data=udp)
+            writer.writepkt(dpkt.ethernet.Ethernet(data=ip), ts=timestamp)
+    assert loadgen.read_trace(str(pcap_path)) == [(1.0, query.to_wire())]
+
+
+def test_replay():
+    """Checks answers are matched to queries and rcodes are counted."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.setblocking(False)
+
+        def answer():
+            wire, addr = server.recvfrom(512)
+            response = dns.message.make_response(dns.message.from_wire(wire))
+            if response.question[0].name.labels[0] == b'nx':
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            if response.question[0].name.labels[0] != b'lost':
+                server.sendto(response.to_wire(), addr)
+
+        async def run():
+            asyncio.get_running_loop().add_reader(server, answer)
+            queries = [dns.message.make_query(qname, 'A').to_wire()
+                       for qname in ['a.example.', 'nx.example.', 'lost.example.']]
+            return await loadgen.replay('127.0.0.1', server.getsockname()[1],
+                                        loadgen.rate_schedule(queries, qps=60, duration=0.1),
+                                        timeout=0.2)
+
+        report = asyncio.run(run())
+    summary = report.summary()
+    assert (summary['sent'], summary['answered'], summary['lost']) == (6, 4, 2)
+    assert summary['rcodes'] == {'NOERROR': 2, 'NXDOMAIN': 2}
+    assert 0 < summary['latency_ms']['p50'] <= summary['latency_ms']['p99.9']
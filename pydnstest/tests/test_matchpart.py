@@ -0,0 +1,71 @@
+""" This is unittest file for matchpart.py """
+
+import dns.message
+import dns.rcode
+import dns.rrset
+import pytest
+
+from pydnstest.matchpart import (
+    MATCH, DataMismatch, compare_rrs, compile_matchers, match_part, matches)
+
+
+def make_messages():
+    """Returns list of messages which differ in various match fields."""
+    base = dns.message.make_query('example.com.', 'A', want_dnssec=True)
+    messages = [base, dns.message.make_query('EXAMPLE.com.', 'A'),
+                dns.message.make_query('www.example.com.', 'AAAA'),
+                dns.message.make_query('example.com.', 'A', use_edns=False),
+                dns.message.Message()]
+    reply = dns.message.make_response(base)
+    reply.set_rcode(dns.rcode.NXDOMAIN)
+    messages.append(reply)
+    answer = dns.message.make_response(base)
+    answer.answer.append(dns.rrset.from_text('example.com.', 300, 'IN', 'A', '192.0.2.1'))
+    answer.authority.append(dns.rrset.from_text('example.com.', 300, 'IN', 'NS', 'ns.example.'))
+    messages.append(answer)
+    return messages
+
+
+def test_matches__same_as_match_part():
+    """Checks predicates give the same result as MATCH functions for each field."""
+    messages = make_messages()
+    for code in MATCH:
+        for exp in messages:
+            for got in messages:
+                try:
+                    match_part(exp, got, code)
+                    expected = True
+                except DataMismatch:
+                    expected = False
+                assert matches(exp, got, [code]) == expected, (code, exp, got)
+                assert matches(exp, got, compile_matchers([code])) == expected
+
+
+def test_compile_matchers():
+    """Checks predicates are ordered from the cheapest one and unknown fields are rejected."""
+    assert compile_matchers(['answer', 'qname', 'opcode', 'qname']) == compile_matchers(
+        ['opcode', 'qname', 'answer'])
+    with pytest.raises(NotImplementedError):
+        compile_matchers(['qname', 'everything'])
+
+
+def test_compare_rrs():
+    """Checks RR sets are compared regardless of order, owner case and TTL."""
+    def rrs(*texts):
+        return [dns.rrset.from_text(*text.split(' ', 4)) for text in texts]
+
+    expected = rrs('example.com. 300 IN A 192.0.2.1', 'example.com. 300 IN NS ns.example.',
+                   'example.com. 300 IN A 192.0.2.2')
+    assert compare_rrs(expected, rrs('EXAMPLE.com. 300 IN A 192.0.2.2',
+                                     'example.com. 60 IN NS NS.example.',
+                                     'example.com. 300 IN A 192.0.2.1'))
+    # duplicates count only towards the length, as with list membership tests
+    assert compare_rrs(rrs('a. 1 IN A 192.0.2.1', 'a. 1 IN A 192.0.2.1', 'b. 1 IN A 192.0.2.1'),
+                       rrs('a. 1 IN A 192.0.2.1', 'b. 1 IN A 192.0.2.1', 'b. 1 IN A 192.0.2.1'))
+    got = rrs('example.com. 300 IN A 192.0.2.1', 'example.com. 300 IN NS ns.example.',
+              'example.com. 300 IN A 192.0.2.3')
+    with pytest.raises(DataMismatch) as excinfo:
+        compare_rrs(expected, got)
+    assert excinfo.value == DataMismatch(expected, got)
+    with pytest.raises(DataMismatch):
+        compare_rrs(expected, expected[:2])
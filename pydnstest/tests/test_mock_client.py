@@ -0,0 +1,104 @@
+""" This is unittest file for mock_client.py """
+
+import socket
+import threading
+import time
+
+import pytest
+
+from pydnstest import mock_client
+
+
+@pytest.fixture(name='tcp_pair')
+def fixture_tcp_pair():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+    with client, server:
+        yield client, server
+
+
+def test_recvfrom_blob__tcp(tcp_pair):
+    """Checks messages are received whole with the length prefix sent separately."""
+    client, server = tcp_pair
+    messages = [b'\x12\x34' + bytes(range(256)) * 200, b'', b'short']
+    for message in messages:
+        mock_client.sendto_msg(client, message)
+    for message in messages:
+        data, addr = mock_client.recvfrom_blob(server)
+        assert data == message and isinstance(data, bytes)
+        assert addr == '127.0.0.1'
+
+
+def test_recvfrom_blob__udp():
+    """Checks received messages do not share the receive buffer."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        server.bind(('127.0.0.1', 0))
+        with pytest.raises(BlockingIOError):
+            mock_client.recvfrom_nowait(server)
+        mock_client.sendto_msg(client, b'first', server.getsockname())
+        mock_client.sendto_msg(client, b'2nd', server.getsockname())
+        first, addr = mock_client.recvfrom_blob(server)
+        second, _ = mock_client.recvfrom_nowait(server)
+        assert (first, second) == (b'first', b'2nd')
+        assert addr == ('127.0.0.1', client.getsockname()[1])
+
+
+def test_client_pool__udp():
+    """Checks answers are matched by ID and the socket is reused by next exchanges."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server, \
+            mock_client.ClientPool() as pool:
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        clients = []
+
+        def answer_reversed(count):
+            queries = [server.recvfrom(512) for _ in range(count)]
+            clients.append(queries[0][1])
+            for query, client in reversed(queries):
+                server.sendto(query + b' answer', client)
+
+        thread = threading.Thread(target=answer_reversed, args=(2,))
+        thread.start()
+        answers = pool.exchange('127.0.0.1', port, [b'\x00\x01 first', b'\x00\x02 second'])
+        thread.join()
+        assert answers == [b'\x00\x01 first answer', b'\x00\x02 second answer']
+
+        server.sendto(b'\x00\x03 late', clients[0])
+        thread = threading.Thread(target=answer_reversed, args=(1,))
+        thread.start()
+        assert pool.exchange('127.0.0.1', port, [b'\x00\x03 third']) == [b'\x00\x03 third answer']
+        thread.join()
+        assert clients[0] == clients[1]
+        assert pool.exchange('127.0.0.1', port, [b'\x00\x04 raw'], expect_answers=False) is None
+        assert len(pool.sockets) == 1
+
+
+def test_get_answers__unexpected_id():
+    """Checks answer with unexpected ID is returned for the first query without answer."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server, \
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        server.bind(('127.0.0.1', 0))
+        client.connect(server.getsockname())
+        for answer in [b'\x00\x02 second', b'\xff\xff wrong', b'\x00\x01 first']:
+            server.sendto(answer, client.getsockname())
+        answers = mock_client.get_answers(client, [b'\x00\x01 q', b'\x00\x02 q', b'\x00\x03 q'])
+        assert answers == [b'\xff\xff wrong', b'\x00\x02 second', b'\x00\x01 first']
+
+
+def test_client_pool__abort():
+    """Checks abort from another thread fails exchange waiting for answer at once."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server, \
+            mock_client.ClientPool() as pool:
+        server.bind(('127.0.0.1', 0))
+        timer = threading.Timer(0.2, pool.abort, args=('process kresd terminated',))
+        timer.start()
+        start = time.monotonic()
+        with pytest.raises(ValueError, match='process kresd terminated'):
+            pool.exchange('127.0.0.1', server.getsockname()[1], [b'\x00\x01 query'])
+        assert time.monotonic() - start < mock_client.SOCKET_OPERATION_TIMEOUT / 2
+        with pytest.raises(ValueError, match='process kresd terminated'):
+            pool.exchange('127.0.0.1', server.getsockname()[1], [b'\x00\x02 query'])
@@ -0,0 +1,112 @@
+""" This is unittest file for rplparser.py """
+
+import pytest
+
+from pydnstest.rplparser import RplSyntaxError, parse_string
+from pydnstest.scenario import parse_tree
+
+SCENARIO = """\
+; comment
+    query-minimization: off
+    stub-addr: 193.0.14.129 	# K.ROOT-SERVERS.NET.
+CONFIG_END
+
+SCENARIO_BEGIN Test native parser
+
+RANGE_BEGIN 0 100
+    ADDRESS 193.0.14.129  ; K.ROOT-SERVERS.NET.
+    ADDRESS 192.0.2.1
+ENTRY_BEGIN
+MATCH opcode qtype qname
+ADJUST copy_id
+REPLY QR NOERROR
+SECTION QUESTION
+. IN NS
+SECTION ANSWER
+. IN NS	K.ROOT-SERVERS.NET.
+SECTION ADDITIONAL
+K.ROOT-SERVERS.NET.	3600 IN	A	193.0.14.129
+ENTRY_END
+RANGE_END
+
+STEP 1 QUERY
+ENTRY_BEGIN
+REPLY RD
+SECTION QUESTION
+. IN NS
+ENTRY_END
+
+STEP 10 CHECK_ANSWER
+ENTRY_BEGIN
+MATCH all
+MANDATORY
+REPLY QR RD RA NOERROR
+SECTION QUESTION
+. IN NS
+SECTION ANSWER
+. IN NS	K.ROOT-SERVERS.NET.
+ENTRY_END
+
+STEP 20 TIME_PASSES ELAPSE 10
+
+STEP 30 QUERY
+ENTRY_BEGIN
+RAW
+b5c9ca3d50104320f4120000000000000000
+ENTRY_END
+SCENARIO_END
+"""
+
+
+def test_parse_string__tree():
+    """Checks shape of the tree matches the Augeas lens."""
+    root = parse_string(SCENARIO, '/test.rpl')
+    assert [n.value for n in root.match("/config/*")] == [
+        '; comment', '    query-minimization: off',
+        '    stub-addr: 193.0.14.129 \t# K.ROOT-SERVERS.NET.']
+    scenario = root["/scenario"]
+    assert scenario.value == 'Test native parser'
+    rng = scenario["/range"]
+    assert (rng["/from"].value, rng["/to"].value) == ('0', '100')
+    assert [a.value for a in rng.match("/address/*")] == ['193.0.14.129', '192.0.2.1']
+    entry = rng["/entry"]
+    assert [m.value for m in entry.match("/match")] == ['opcode', 'qtype', 'qname']
+    assert [s.path for s in entry.match("/section/*")] == [
+        '/files/test.rpl/scenario/range/entry/section/question',
+        '/files/test.rpl/scenario/range/entry/section/answer',
+        '/files/test.rpl/scenario/range/entry/section/additional']
+    record = entry["/section/additional/record"]
+    assert [(n.label, n.value) for n in record.children] == [
+        ('domain', 'K.ROOT-SERVERS.NET.'), ('ttl', '3600'), ('class', 'IN'),
+        ('type', 'A'), ('data', '193.0.14.129')]
+    steps = list(scenario.match("/step"))
+    assert [(s.value, s["/type"].value) for s in steps] == [
+        ('1', 'QUERY'), ('10', 'CHECK_ANSWER'), ('20', 'TIME_PASSES ELAPSE'), ('30', 'QUERY')]
+    assert steps[1]["/entry/mandatory"].line == 34
+    assert steps[2]["/timestamp"].value == '10'
+    assert steps[3]["/entry/raw"].value == 'b5c9ca3d50104320f4120000000000000000'
+
+
+def test_parse_tree__native():
+    """Checks the native tree can be used to build the scenario."""
+    scenario, config = parse_tree(parse_string(SCENARIO, '/test.rpl'))
+    assert config == [['query-minimization', 'off'], ['stub-addr', '193.0.14.129']]
+    assert scenario.file == 'test.rpl'
+    assert scenario.ranges[0].addresses == {'193.0.14.129', '192.0.2.1'}
+    assert [step.id for step in scenario.steps] == [1, 10, 20, 30]
+    assert scenario.steps[1].data[0].mandatory.span == 'line 34 (char position 557)'
+
+
+@pytest.mark.parametrize("old, new, line", [
+    ("SCENARIO_END\n", "", 48),
+    ("MATCH all", "MATCH everything", 33),
+    ("SECTION ANSWER\n. IN NS\tK", "SECTION ANSWER\n. IN\tK", 18),
+    ("STEP 20 TIME_PASSES ELAPSE 10", "STEP 20 TIME_PASSES", 42),
+    ("REPLY RD", "SECTION ANSWER\nREPLY RD", 27),
+])
+def test_parse_string__errors(old, new, line):
+    """Checks syntax errors are reported with line numbers."""
+    with pytest.raises(RplSyntaxError) as excinfo:
+        parse_string(SCENARIO.replace(old, new, 1), 'test.rpl')
+    assert excinfo.value.line == line
+    assert str(excinfo.value).startswith(f'test.rpl:{line}: ')
@@ -1,8 +1,12 @@
 """ This is unittest file for scenario.py """
 
+import dns.message
+import dns.rcode
 import pytest
 
-from pydnstest.scenario import Entry
+from pydnstest.rplparser import parse_string
+from pydnstest.scenario import DNSReply, Entry, parse_tree, sample_delay
+from pydnstest.scenario_cache import SCENARIO_CACHE, parse_file_cached
 
 RCODE_FLAGS = ['NOERROR', 'FORMERR', 'SERVFAIL', 'NXDOMAIN', 'NOTIMP', 'REFUSED', 'YXDOMAIN',
                'YXRRSET', 'NXRRSET', 'NOTAUTH', 'NOTZONE', 'BADVERS']
@@ -51,3 +55,309 @@ def test_entry__get_opcode():
     for opcode in OPCODE_FLAGS:
         given_rcode = Entry.get_opcode(FLAGS + RCODE_FLAGS + [opcode])
         assert given_rcode is not None, f'Entry.get_opcode does not recognize {opcode}'
+
+
+CACHED_SCENARIO = """\
+CONFIG_END
+
+SCENARIO_BEGIN Test parsed scenario cache
+
+RANGE_BEGIN 0 100
+    ADDRESS 192.0.2.1
+ENTRY_BEGIN
+MATCH opcode qtype qname
+ADJUST copy_id
+REPLY QR NOERROR
+SECTION QUESTION
+example.com. IN A
+ENTRY_END
+RANGE_END
+
+STEP 1 REPLY
+ENTRY_BEGIN
+MATCH opcode qtype qname
+ADJUST copy_id
+REPLY QR NOERROR
+SECTION QUESTION
+example.net. IN A
+ENTRY_END
+SCENARIO_END
+"""
+
+
+def test_parse_file_cached(tmp_path):
+    """
+    Checks scenario is parsed only once while its content is unchanged
+    and that each caller gets fresh run-time state.
+    """
+    path = str(tmp_path / 'cached.rpl')
+    with open(path, 'w', encoding='utf-8') as rpl:
+        rpl.write(CACHED_SCENARIO)
+
+    first, _ = parse_file_cached(path)
+    first.ranges[0].stored[0].fired += 1
+    first.ranges[0].received += 1
+    first.steps[0].data.clear()
+
+    second, _ = parse_file_cached(path)
+    assert SCENARIO_CACHE[path][1] is not second
+    assert second.ranges[0].stored[0].message is first.ranges[0].stored[0].message
+    assert second.ranges[0].stored[0].fired == 0
+    assert second.ranges[0].received == 0
+    assert len(second.steps[0].data) == 1
+
+    with open(path, 'w', encoding='utf-8') as rpl:
+        rpl.write(CACHED_SCENARIO.replace('example.net.', 'example.org.'))
+    third, _ = parse_file_cached(path)
+    assert third.ranges[0].stored[0].message is not first.ranges[0].stored[0].message
+    assert str(third.steps[0].data[0].message.question[0].name) == 'example.org.'
+
+
+def test_entry__lazy():
+    """Checks entry message and matchers are built on first use and shared with fresh copies."""
+    scenario, _ = parse_tree(parse_string(CACHED_SCENARIO, 'lazy.rpl'))
+    entry = scenario.ranges[0].stored[0]
+    assert not entry._lazy  # pylint: disable=protected-access
+    copied = entry.fresh_copy()
+    assert str(copied.message.question[0].name) == 'example.com.'
+    assert entry.message is copied.message
+    assert entry.raw_data is None
+    assert entry.sections == {'question'}
+    assert 'matchers' not in entry._lazy  # pylint: disable=protected-access
+    assert copied.matches(entry.message) and entry.matchers is copied.matchers
+
+
+def test_scenario__materialize():
+    """Checks malformed record is reported with its location when messages are built."""
+    text = CACHED_SCENARIO.replace('example.com. IN A\n', 'example.com. IN A\n'
+                                   'SECTION ANSWER\nexample.com. IN A 192.0.2\n')
+    scenario, _ = parse_tree(parse_string(text, '/tmp/malformed.rpl'))
+    with pytest.raises(ValueError, match=r'^/tmp/malformed.rpl: entry at line 7 .*'
+                                         r'record at line 14 .*malformed'):
+        scenario.materialize()
+    with pytest.raises(ValueError, match='record at line 14'):
+        scenario.ranges[0].stored[0].message  # pylint: disable=pointless-statement
+
+
+def test_parse_file_cached__malformed(tmp_path):
+    """Checks malformed record in an entry which never fires is reported by parsing."""
+    path = tmp_path / 'malformed.rpl'
+    path.write_text(CACHED_SCENARIO.replace('example.com. IN A\n', 'example.com. IN A\n'
+                                            'SECTION ANSWER\nexample.com. IN A 192.0.2\n'))
+    with pytest.raises(ValueError, match=f'^{path}: entry at line 7 .*record at line 14'):
+        parse_file_cached(str(path))
+    assert str(path) not in SCENARIO_CACHE
+
+
+INDEXED_RANGE = """\
+CONFIG_END
+SCENARIO_BEGIN Test range index
+RANGE_BEGIN 0 100
+    ADDRESS 192.0.2.1
+ENTRY_BEGIN
+MATCH opcode qtype qname
+REPLY QR NOERROR
+SECTION QUESTION
+example.com. IN A
+ENTRY_END
+ENTRY_BEGIN
+MATCH opcode subdomain
+REPLY QR NXDOMAIN
+SECTION QUESTION
+com. IN NS
+ENTRY_END
+ENTRY_BEGIN
+MATCH opcode qtype qname
+REPLY QR SERVFAIL
+SECTION QUESTION
+EXAMPLE.com. IN A
+ENTRY_END
+ENTRY_BEGIN
+MATCH opcode qtype qname
+REPLY QR REFUSED
+SECTION QUESTION
+example.com. IN AAAA
+ENTRY_END
+RANGE_END
+SCENARIO_END
+"""
+
+
+def test_range__candidates():
+    """Checks indexed lookup returns plausible entries in the order they are defined."""
+    scenario, _ = parse_tree(parse_string(INDEXED_RANGE, 'index.rpl'))
+    rng = scenario.ranges[0]
+    stored = rng.stored
+    assert rng.candidates(dns.message.make_query('Example.COM.', 'A')) == [
+        stored[0], stored[1], stored[2]]
+    assert rng.candidates(dns.message.make_query('example.com.', 'AAAA')) == [
+        stored[1], stored[3]]
+    assert rng.candidates(dns.message.make_query('example.net.', 'A')) == [stored[1]]
+    reply = rng.reply(dns.message.make_query('www.example.com.', 'A'))
+    assert reply.message.rcode() == dns.rcode.NXDOMAIN
+
+
+RANGES_SCENARIO = """\
+CONFIG_END
+SCENARIO_BEGIN Test range eligibility
+RANGE_BEGIN 0 10
+    ADDRESS 192.0.2.1
+RANGE_END
+RANGE_BEGIN 5 20
+    ADDRESS 192.0.2.2
+RANGE_END
+RANGE_BEGIN 0 25
+    ADDRESS 192.0.2.3
+RANGE_END
+STEP 1 QUERY
+STEP 30 REPLY
+ENTRY_BEGIN
+MATCH opcode qtype qname
+REPLY QR NOERROR
+SECTION QUESTION
+example.com. IN A
+ENTRY_END
+SCENARIO_END
+"""
+
+
+def test_scenario__eligible_range():
+    """Checks range index selects the same range as linear scan over Range.eligible()."""
+    scenario, _ = parse_tree(parse_string(RANGES_SCENARIO, 'ranges.rpl'))
+    for ident in [-1, 0, 4, 5, 10, 11, 20, 21, 25, 26]:
+        for address in [None, '192.0.2.1', '192.0.2.2', '192.0.2.3']:
+            expected = next((rng for rng in scenario.ranges if rng.eligible(ident, address)),
+                            None)
+            assert scenario.eligible_range(ident, address) is expected, (ident, address)
+
+
+def test_scenario__reply_step():
+    """Checks one-shot REPLY entries are used once and only by steps up to their ID."""
+    scenario, _ = parse_tree(parse_string(RANGES_SCENARIO, 'ranges.rpl'))
+    scenario.current_step = scenario.steps[0]
+    query = dns.message.make_query('example.com.', 'A')
+    scenario.current_step.id = 31
+    assert scenario.reply(query).message.rcode() == dns.rcode.SERVFAIL
+    scenario.current_step.id = 26
+    assert scenario.reply(query).message.rcode() == dns.rcode.NOERROR
+    assert scenario.reply(query).message.rcode() == dns.rcode.SERVFAIL
+
+
+def test_dns_reply__template():
+    """Checks reply patched in wire format is the same as reply adjusted by dnspython."""
+    scenario, _ = parse_tree(parse_string(INDEXED_RANGE, 'index.rpl'))
+    entry = scenario.ranges[0].stored[1]
+    queries = [dns.message.make_query('COM.', 'NS', use_edns=False),
+               dns.message.make_query('cOm.', 'NS', want_dnssec=True),
+               dns.message.make_query('www.com.', 'NS')]
+    for query in queries:
+        for copy_id, copy_query in [(True, False), (False, True), (True, True)]:
+            expected = DNSReply(entry.message, query, copy_id, copy_query)
+            reply = DNSReply(entry.message, query, copy_id, copy_query, entry.reply_template)
+            assert reply.to_wire() == expected.to_wire()
+            assert (reply.wire is None) == (query is queries[-1])
+
+
+BATCH_SCENARIO = """\
+CONFIG_END
+SCENARIO_BEGIN Test query batch
+STEP 1 QUERY_BATCH\tTCP 2
+ENTRY_BEGIN
+SECTION QUESTION
+a.example. IN A
+ENTRY_END
+ENTRY_BEGIN
+SECTION QUESTION
+b.example. IN A
+ENTRY_END
+STEP 2 CHECK_ANSWER 2
+ENTRY_BEGIN
+MATCH question
+SECTION QUESTION
+b.example. IN A
+ENTRY_END
+SCENARIO_END
+"""
+
+
+def test_step__batch_answers():
+    """Checks CHECK_ANSWER with index checks answers to all copies of the batch query."""
+    scenario, _ = parse_tree(parse_string(BATCH_SCENARIO, 'batch.rpl'))
+    batch, check = scenario.steps
+    assert (batch.type, batch.batch_copies, len(batch.data)) == ('QUERY_BATCH TCP', 2, 2)
+    assert check.batch_index == 2
+    batch.answers = [dns.message.make_response(dns.message.make_query(qname, 'A'))
+                     for qname in ['a.example.', 'a.example.', 'b.example.', 'b.example.']]
+    assert batch.batch_answers(2) == batch.answers[2:]
+    assert not batch.batch_answers(0) and not batch.batch_answers(3)
+    scenario.last_batch = batch
+    check.play(scenario)
+    check.batch_index = 1
+    with pytest.raises(ValueError):
+        check.play(scenario)
+    check.batch_index = 3
+    with pytest.raises(ValueError, match='has no query 3'):
+        check.play(scenario)
+
+
+def test_step__batch_parse():
+    """Checks number after CHECK_ANSWER is an index only after QUERY_BATCH, empty batch fails."""
+    text = BATCH_SCENARIO.replace('QUERY_BATCH\tTCP 2', 'QUERY')
+    _, check = parse_tree(parse_string(text, 'batch.rpl'))[0].steps
+    assert check.batch_index is None
+    for step in ['STEP 1 QUERY_BATCH\n', 'STEP 1 QUERY_BATCH 0\nENTRY_BEGIN\nENTRY_END\n']:
+        text = f'CONFIG_END\nSCENARIO_BEGIN Empty batch\n{step}SCENARIO_END\n'
+        with pytest.raises(ValueError, match='QUERY_BATCH step 1 at line 3'):
+            parse_tree(parse_string(text, 'batch.rpl'))
+
+
+DELAY_SCENARIO = """\
+CONFIG_END
+SCENARIO_BEGIN Test reply delay
+RANGE_BEGIN 0 100
+    ADDRESS 192.0.2.1
+    DELAY 100 20
+ENTRY_BEGIN
+MATCH opcode qtype qname
+DELAY 300
+REPLY QR NOERROR
+SECTION QUESTION
+slow.example. IN A
+ENTRY_END
+ENTRY_BEGIN
+MATCH opcode qtype
+REPLY QR NOERROR
+SECTION QUESTION
+example. IN A
+ENTRY_END
+RANGE_END
+RANGE_BEGIN 0 100
+    ADDRESS 192.0.2.2
+    LOSS 1
+ENTRY_BEGIN
+MATCH opcode qtype
+REPLY QR NOERROR
+SECTION QUESTION
+example. IN A
+ENTRY_END
+RANGE_END
+STEP 1 QUERY
+ENTRY_BEGIN
+SECTION QUESTION
+example. IN A
+ENTRY_END
+SCENARIO_END
+"""
+
+
+def test_range__delay_loss():
+    """Checks entry DELAY overrides range DELAY and LOSS drops the query silently."""
+    scenario, _ = parse_tree(parse_string(DELAY_SCENARIO, 'delay.rpl'))
+    scenario.current_step = scenario.steps[0]
+    slow = scenario.reply(dns.message.make_query('slow.example.', 'A'), '192.0.2.1')
+    assert slow.delay == 0.3
+    for _ in range(10):
+        reply = scenario.reply(dns.message.make_query('example.', 'A'), '192.0.2.1')
+        assert 0.08 <= reply.delay <= 0.12
+    assert scenario.reply(dns.message.make_query('example.', 'A'), '192.0.2.2') is None
+    assert sample_delay((0.01, 0.05)) >= 0
@@ -0,0 +1,31 @@
+""" This is unittest file for sharedstate.py """
+
+import pytest
+
+from pydnstest.sharedstate import CONTEXT, SharedCounter, SharedEntries
+
+
+def test_shared_state__workers():
+    """Checks counters and REPLY entries are shared with forked processes."""
+    counter = SharedCounter()
+    entries = SharedEntries(['first', 'second'])
+
+    def worker(worker_counter, worker_entries):
+        worker_counter += 1
+        worker_entries.remove(worker_entries[0])
+
+    proc = CONTEXT.Process(target=worker, args=(counter, entries))
+    proc.start()
+    proc.join()
+    assert proc.exitcode == 0
+    counter += 1
+    assert 1 < counter < 3 and SharedCounter(2) <= counter and counter
+    assert not SharedCounter()
+    assert counter == 2 and '%d' % counter == '2'  # pylint: disable=consider-using-f-string
+    assert len(entries) == 1 and entries[0] == 'second'
+    with pytest.raises(ValueError):
+        entries.remove('first')
+    entries.remove('second')
+    assert not entries
+    with pytest.raises(IndexError):
+        entries[0]  # pylint: disable=pointless-statement
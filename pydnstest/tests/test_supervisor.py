@@ -0,0 +1,56 @@
+""" This is unittest file for supervisor.py """
+
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from pydnstest import supervisor
+
+IGNORE_SIGTERM = ('import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                  'print(flush=True); time.sleep(10)')
+
+
+def daemon(args, **cfg):
+    # pylint: disable=consider-using-with
+    return {'proc': subprocess.Popen(args, stdout=subprocess.PIPE),
+            'cfg': {'name': args[0], **cfg}}
+
+
+def test_supervisor():
+    """Checks exit of a daemon is reported immediately with the signal which killed it."""
+    daemons = [daemon(['sleep', '10']), daemon(['sh', '-c', 'sleep 0.2; kill -SEGV $$'])]
+    exited = threading.Event()
+    reported = []
+
+    def on_exit(exited_daemon):
+        reported.append(supervisor.describe_exit(exited_daemon))
+        exited.set()
+
+    try:
+        with supervisor.Supervisor(daemons, on_exit):
+            assert exited.wait(2)
+        assert reported == ['process sh terminated by signal SIGSEGV']
+        assert daemons[1]['exit_signal'] == 'SIGSEGV' and daemons[0]['proc'].poll() is None
+    finally:
+        supervisor.terminate(daemons)
+    assert daemons[0]['exit_signal'] == 'SIGTERM'
+
+
+def test_terminate():
+    """Checks daemons are terminated in parallel and killed after their grace period."""
+    daemons = [daemon([sys.executable, '-c', IGNORE_SIGTERM], grace_period=0.3),
+               daemon([sys.executable, '-c', IGNORE_SIGTERM], grace_period=0.5),
+               daemon([sys.executable, '-c', 'import time; time.sleep(10)'])]
+    for ignoring in daemons[:2]:
+        ignoring['proc'].stdout.readline()  # SIGTERM handler is set
+    start = time.monotonic()
+    supervisor.terminate(daemons)
+    assert time.monotonic() - start < 0.9
+    assert [(d['exit_code'], d['exit_signal'], d.get('killed', False)) for d in daemons] == [
+        (None, 'SIGKILL', True), (None, 'SIGKILL', True), (None, 'SIGTERM', False)]
+    assert 'within its grace period' in supervisor.describe_exit(daemons[0])
+    assert -daemons[2]['proc'].returncode == signal.SIGTERM
+    for finished in daemons:
+        finished['proc'].stdout.close()
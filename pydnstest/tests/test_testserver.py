@@ -0,0 +1,74 @@
+""" This is unittest file for testserver.py """
+
+import socket
+
+import pytest
+from pyroute2 import IPRoute  # pylint: disable=no-name-in-module
+
+from contrib.namespaces import LinuxNamespace
+from pydnstest.rplparser import parse_string
+from pydnstest.scenario import parse_tree
+from pydnstest.testserver import TestServer
+
+# The scenario queries the mock server itself, no binary under test is needed
+SELF_QUERY_SCENARIO = """\
+CONFIG_END
+SCENARIO_BEGIN Test server workers
+RANGE_BEGIN 0 100
+    ADDRESS 127.0.0.10
+ENTRY_BEGIN
+MATCH opcode qtype qname
+ADJUST copy_id
+REPLY QR NOERROR
+SECTION QUESTION
+example. IN A
+SECTION ANSWER
+example. IN A 192.0.2.1
+ENTRY_END
+RANGE_END
+STEP 1 QUERY
+ENTRY_BEGIN
+SECTION QUESTION
+example. IN A
+ENTRY_END
+STEP 2 CHECK_ANSWER
+ENTRY_BEGIN
+MATCH opcode qname answer
+REPLY QR NOERROR
+SECTION QUESTION
+example. IN A
+SECTION ANSWER
+example. IN A 192.0.2.1
+ENTRY_END
+STEP 3 QUERY
+ENTRY_BEGIN
+SECTION QUESTION
+undefined.example. IN A
+ENTRY_END
+STEP 4 CHECK_ANSWER
+ENTRY_BEGIN
+MATCH opcode rcode
+REPLY QR SERVFAIL
+ENTRY_END
+SCENARIO_END
+"""
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_test_server__workers(workers):
+    """Checks a scenario plays with worker processes and undefined answers are counted."""
+    scenario, _ = parse_tree(parse_string(SELF_QUERY_SCENARIO, 'workers.rpl'))
+    with LinuxNamespace("net"):
+        with IPRoute() as ip:
+            ip.link("set", index=ip.link_lookup(ifname="lo")[0],  # pylint: disable=no-member
+                    state="up")
+        server = TestServer(scenario, socket.AF_INET, workers=workers)
+        server.start()
+        try:
+            server.play('127.0.0.10')
+        finally:
+            server.stop()
+    # run_testcase() compares the counter, SharedCounter with workers
+    assert server.undefined_answers > 0
+    assert server.undefined_answers == 1
+    assert scenario.timing.server['udp_queries'] == 2
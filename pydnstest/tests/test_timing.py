@@ -0,0 +1,33 @@
+""" This is unittest file for timing.py """
+
+import json
+
+import pytest
+
+from pydnstest.rplparser import parse_string
+from pydnstest.scenario import parse_tree
+from pydnstest.tests.test_scenario import BATCH_SCENARIO
+from pydnstest.timing import TimingRecorder
+
+
+def test_timing_recorder(tmp_path):
+    """Checks steps are recorded also when they fail and queries belong to the current step."""
+    scenario, _ = parse_tree(parse_string(BATCH_SCENARIO, 'batch.rpl'))
+    timing = TimingRecorder()
+    with timing.record_step(scenario.steps[0]):
+        timing.add_query(1.0, 1.002, 30, 60)
+        timing.add_query(1.0, None, 30, 0)
+    with pytest.raises(ValueError):
+        with timing.record_step(scenario.steps[1]):
+            raise ValueError('answer mismatch')
+    timing.record_server(6, 4)
+    timing.dump(str(tmp_path / 'timing.json'))
+    data = json.loads((tmp_path / 'timing.json').read_text())
+    assert [(step['id'], step['type']) for step in data['steps']] == [
+        (1, 'QUERY_BATCH TCP'), (2, 'CHECK_ANSWER')]
+    assert all(step['start'] <= step['end'] for step in data['steps'])
+    assert data['steps'][0]['queries'][0]['rtt'] == pytest.approx(2)
+    assert data['steps'][0]['queries'][1]['rtt'] is None
+    assert data['summary'] == {'queries': 1, 'mean_rtt': pytest.approx(2),
+                               'max_rtt': pytest.approx(2)}
+    assert data['server'] == {'udp_queries': 6, 'udp_batches': 4, 'mean_batch_size': 1.5}
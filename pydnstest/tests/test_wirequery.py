@@ -0,0 +1,29 @@
+""" This is unittest file for wirequery.py """
+
+import dns.message
+import dns.rrset
+
+from pydnstest.wirequery import WireQuery
+
+ATTRIBUTES = ['id', 'flags', 'question', 'answer', 'authority', 'additional',
+              'edns', 'ednsflags', 'payload']
+
+
+def test_wire_query__same_as_message():
+    """Checks wire view gives the same values as dnspython and parses only unusual queries."""
+    usual = [dns.message.make_query('ExAmple.com.', 'A', use_edns=False),
+             dns.message.make_query('example.com.', 'AAAA', want_dnssec=True, payload=1232),
+             dns.message.make_query('.', 'NS', use_edns=0,
+                                    options=[dns.edns.GenericOption(3, b'')]),
+             dns.message.Message()]
+    unusual = dns.message.make_query('example.com.', 'A')
+    unusual.additional.append(dns.rrset.from_text('ns.example.com.', 300, 'IN', 'A', '192.0.2.1'))
+    for query in usual + [unusual]:
+        wire_query = WireQuery(query.to_wire())
+        expected = dns.message.from_wire(query.to_wire(), one_rr_per_rrset=True)
+        for attr in ATTRIBUTES:
+            assert getattr(wire_query, attr) == getattr(expected, attr), attr
+        assert wire_query.opcode() == expected.opcode()
+        assert wire_query.rcode() == expected.rcode()
+        assert ('message' in wire_query.__dict__) == (query is unusual)
+        assert wire_query.options == expected.options
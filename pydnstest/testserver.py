@@ -1,8 +1,8 @@
 import argparse
+import heapq
 import itertools
 import logging
 import os
-import random
 import signal
 import selectors
 import socket
@@ -13,10 +13,15 @@ import time
 import dns.message
 import dns.rdatatype
 
-from pydnstest import scenario, mock_client
+from pydnstest import scenario, mock_client, sharedstate
+from pydnstest.wirequery import WireQuery
 from networking import InterfaceManager
 
 
+# Linux value, not exported by the socket module
+IP_FREEBIND = getattr(socket, 'IP_FREEBIND', 15)
+
+
 class TestServerError(Exception):
     pass
 
@@ -25,21 +30,62 @@ class QueryIoError(Exception):
     pass
 
 
+class ReplyScheduler:
+    """ Replies delayed by the scenario, sent from the server loop when they are due. """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()  # keeps order of replies with the same due time
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, delay, sock, wire, addr):
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), sock, wire, addr))
+
+    def timeout(self):
+        """ Returns seconds until the next reply is due, None if there is none """
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0)
+
+    def send_due(self):
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, sock, wire, addr = heapq.heappop(self.heap)
+            try:
+                mock_client.sendto_msg(sock, wire, addr)
+            except OSError:  # TCP connection closed in the meantime
+                pass
+
+
 class TestServer:
     """ This simulates UDP DNS server returning scripted or mirror DNS responses. """
 
-    RETRIES_ON_BIND = 3
+    LISTEN_BACKLOG = socket.SOMAXCONN
+    UDP_BATCH_SIZE = 64
 
     def __init__(self, test_scenario, addr_family,
-                 deckard_address=None, if_manager=None):
-        """ Initialize server instance. """
+                 deckard_address=None, if_manager=None, workers=1):
+        """
+        Initialize server instance.
+
+        With workers > 1 UDP queries are served also by worker processes
+        using their own SO_REUSEPORT sockets bound to the same addresses.
+        """
         self.thread = None
+        self.workers = workers
+        self.worker_procs = []
+        self.worker_stop = None
         self.srv_socks = []
+        self.srv_index = {}  # (family, address, proto) -> socket
         self.client_socks = []
         self.connections = []
         self.active = False
         self.active_lock = threading.Lock()
-        self.condition = threading.Condition()
+        self.selector = None
+        self.wakeup = None
+        self.scheduler = ReplyScheduler()
         self.scenario = test_scenario
         self.scenario.deckard_address = deckard_address
         self.addr_map = []
@@ -47,6 +93,8 @@ class TestServer:
         self.cur_iface = self.start_iface
         self.addr_family = addr_family
         self.undefined_answers = 0
+        self.udp_batches = 0
+        self.udp_queries = 0
         self.if_manager = if_manager
 
     def __del__(self):
@@ -64,14 +112,47 @@ class TestServer:
         with self.active_lock:
             self.active = True
 
+        self.scheduler = ReplyScheduler()
+        self.undefined_answers = 0
+        self.udp_batches = 0
+        self.udp_queries = 0
+        if self.workers > 1:
+            sharedstate.share_scenario_state(self.scenario)
+            self.undefined_answers = sharedstate.SharedCounter()
+            self.udp_batches = sharedstate.SharedCounter()
+            self.udp_queries = sharedstate.SharedCounter()
+
+        # Sockets are registered once, stop() interrupts select() through the wakeup socket
+        self.selector = selectors.DefaultSelector()
+        self.wakeup = socket.socketpair()
+        self.selector.register(self.wakeup[0], selectors.EVENT_READ)
         self._bind_sockets()
+        if self.workers > 1:
+            self._start_workers()
+
+        self.thread = threading.Thread(target=self.query_io)
+        self.thread.start()
 
     def stop(self):
         """ Stop socket server operation. """
         with self.active_lock:
             self.active = False
         if self.thread:
+            self.wakeup[1].send(b'\0')
             self.thread.join()
+            self.thread = None
+        self._stop_workers()
+        logging.getLogger('pydnstest.testserver').info(
+            'received %d UDP queries in %d batches, average batch size %.1f',
+            int(self.udp_queries), int(self.udp_batches), self.batch_size())
+        if self.scenario is not None:
+            self.scenario.timing.record_server(int(self.udp_queries), int(self.udp_batches))
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+            for sock in self.wakeup:
+                sock.close()
+            self.wakeup = None
         for conn in self.connections:
             conn.close()
         for srv_sock in self.srv_socks:
@@ -80,6 +161,7 @@ class TestServer:
             client_sock.close()
         self.client_socks = []
         self.srv_socks = []
+        self.srv_index = {}
         self.connections = []
         self.scenario = None
 
@@ -95,20 +177,63 @@ class TestServer:
         Receive query from client socket and send an answer.
 
         Returns:
-            True if client socket should be closed by caller
-            False if client socket should be kept open
+            True if client socket should be kept open
+            False if client socket should be closed by caller
         """
-        log = logging.getLogger('pydnstest.testserver.handle_query')
         server_addr = client.getsockname()[0]
-        query, client_addr = mock_client.recvfrom_msg(client)
-        if query is None:
-            return False
+        data, client_addr = mock_client.recvfrom_blob(client)
+        answer = self.answer_query(data, client_addr, server_addr)
+        if answer is not None:
+            self.send_reply(client, *answer, client_addr)
+        return True
+
+    def send_reply(self, sock, wire, delay, addr):
+        """ Send reply now or schedule it for sending from the server loop """
+        if delay > 0:
+            self.scheduler.schedule(delay, sock, wire, addr)
+        else:
+            mock_client.sendto_msg(sock, wire, addr)
+
+    def handle_udp(self, sock):
+        """
+        Drain readable UDP socket and send answers to all received queries in one batch.
+
+        At most UDP_BATCH_SIZE queries are received at once so other sockets are not starved.
+        """
+        server_addr = sock.getsockname()[0]
+        replies = []
+        received = 0
+        while received < self.UDP_BATCH_SIZE:
+            try:
+                data, client_addr = mock_client.recvfrom_nowait(sock)
+            except BlockingIOError:
+                break
+            received += 1
+            answer = self.answer_query(data, client_addr, server_addr)
+            if answer is not None:
+                replies.append((*answer, client_addr))
+        if not received:
+            return
+        self.udp_batches += 1
+        self.udp_queries += received
+        for wire, delay, client_addr in replies:
+            self.send_reply(sock, wire, delay, client_addr)
+
+    def answer_query(self, data, client_addr, server_addr):
+        """
+        Returns (answer in wire format, delay in seconds) for query received by server_addr,
+        None to ignore the query
+        """
+        log = logging.getLogger('pydnstest.testserver.handle_query')
+        # Header and question are read directly from wire, the query is fully parsed
+        # only if a matching entry needs other data
+        query = WireQuery(data)
         log.debug('server %s received query from %s: %s', server_addr, client_addr, query)
 
         message = self.scenario.reply(query, server_addr)
         if not message:
             log.debug('ignoring')
-            return True
+            return None
         elif isinstance(message, scenario.DNSReplyServfail):
             self.undefined_answers += 1
             self.scenario.current_step.log.error(
@@ -125,46 +250,40 @@ class TestServer:
                         'reported EDNS payload (%d B). The test may fail '
                         'due to insufficient buffer size.',
                         wire_len, query.payload)
+        return wire, message.delay
 
-        mock_client.sendto_msg(client, wire, client_addr)
-        return True
+    def batch_size(self):
+        """ Returns average number of UDP queries received per batch """
+        if not self.udp_batches:
+            return 0.0
+        return int(self.udp_queries) / int(self.udp_batches)
 
     def query_io(self):
-        """ Main server process """
-        self.undefined_answers = 0
+        """ Main server process, serves registered sockets until stop() """
         with self.active_lock:
             if not self.active:
                 raise QueryIoError("Test server not active")
         while True:
-            with self.condition:
-                self.condition.notify()
-            with self.active_lock:
-                if not self.active:
-                    break
-            objects = self.srv_socks + self.connections
-            sel = selectors.DefaultSelector()
-            for obj in objects:
-                sel.register(obj, selectors.EVENT_READ)
-            items = sel.select(0.1)
-            for key, event in items:
-                sock = key.fileobj
-                if event & selectors.EVENT_READ:
-                    if sock in self.srv_socks:
-                        if sock.proto == socket.IPPROTO_TCP:
-                            conn, _ = sock.accept()
-                            self.connections.append(conn)
-                        else:
-                            self.handle_query(sock)
-                    elif sock in self.connections:
-                        if not self.handle_query(sock):
-                            sock.close()
-                            self.connections.remove(sock)
-                    else:
-                        raise QueryIoError(
-                            f"[query_io] Socket IO internal error {sock.getsockname()}, exit"
-                        )
-                else:
-                    raise QueryIoError(f"[query_io] Socket IO error {sock.getsockname()}, exit")
+            for key, _ in self.selector.select(self.scheduler.timeout()):
+                if key.fileobj is self.wakeup[0]:
+                    return
+                key.data(key.fileobj)
+            self.scheduler.send_due()
+
+    def _accept(self, srv_sock):
+        conn, _ = srv_sock.accept()
+        self.connections.append(conn)
+        self.selector.register(conn, selectors.EVENT_READ, self._handle_connection)
+
+    def _handle_connection(self, conn):
+        try:
+            keep_open = self.handle_query(conn)
+        except OSError:  # closed by client
+            keep_open = False
+        if not keep_open:
+            self.selector.unregister(conn)
+            self.connections.remove(conn)
+            conn.close()
 
     def start_srv(self, address, family, proto=socket.IPPROTO_UDP):
         """ Starts listening thread if necessary """
@@ -186,46 +305,84 @@ class TestServer:
         else:
             raise NotImplementedError(f"[start_srv] unsupported protocol {proto}")
 
-        if self.thread is None:
-            self.thread = threading.Thread(target=self.query_io)
-            self.thread.start()
-            with self.condition:
-                self.condition.wait()
-
-        for srv_sock in self.srv_socks:
-            if (srv_sock.family == family
-                    and srv_sock.getsockname()[:2] == address
-                    and srv_sock.proto == proto):
-                return
+        if (family, address, proto) in self.srv_index:
+            return
 
-        sock = socket.socket(family, socktype, proto)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock = self.bind_socket(address, family, socktype, proto,
+                                reuseport=self.workers > 1 and proto == socket.IPPROTO_UDP)
 
         # Add address to interface when running from Deckard
         if self.if_manager is not None:
             if address[0] not in self.if_manager.added_addresses:
                 self.if_manager.add_address(address[0])
 
-        # A lot of addresses are added to the interface while runnning from Deckard in
-        # the small amount of time which caused ocassional hiccups while binding to them
-        # right afterwards in testing. Therefore, we retry a few times.
-        final_ex = None
-        for i in range(self.RETRIES_ON_BIND):
-            try:
-                sock.bind(address)
-                break
-            except OSError as ex:
-                # Exponential backoff
-                time.sleep((2 ** i) + random.random())
-                final_ex = ex
-                continue
-        else:
-            print(final_ex, address)
-            raise final_ex
-
         if proto == socket.IPPROTO_TCP:
-            sock.listen(5)
+            sock.listen(self.LISTEN_BACKLOG)
+            self.selector.register(sock, selectors.EVENT_READ, self._accept)
+        else:
+            self.selector.register(sock, selectors.EVENT_READ, self.handle_udp)
         self.srv_socks.append(sock)
+        self.srv_index[(family, address, proto)] = sock
+
+    @staticmethod
+    def bind_socket(address, family, socktype, proto, reuseport=False):
+        """
+        Create socket bound to address which does not have to be configured yet.
+
+        IP_FREEBIND allows binding before the address is added to the interface (or while
+        it is still being set up), so binding never has to be retried.
+        """
+        sock = socket.socket(family, socktype, proto)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuseport:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_IP, IP_FREEBIND, 1)
+        try:
+            sock.bind(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _start_workers(self):
+        """ Fork worker processes serving UDP on all addresses bound by this server """
+        addresses = [(sock.getsockname(), sock.family) for sock in self.srv_socks
+                     if sock.proto == socket.IPPROTO_UDP]
+        self.worker_stop = os.pipe()
+        for _ in range(self.workers - 1):
+            proc = sharedstate.CONTEXT.Process(target=self._serve_worker, args=(addresses,),
+                                               daemon=True)
+            proc.start()
+            self.worker_procs.append(proc)
+
+    def _serve_worker(self, addresses):
+        """ Worker process main loop, runs until stop() closes the stop pipe """
+        os.close(self.worker_stop[1])
+        selector = selectors.DefaultSelector()
+        selector.register(self.worker_stop[0], selectors.EVENT_READ)
+        for address, family in addresses:
+            sock = self.bind_socket(address, family, socket.SOCK_DGRAM, socket.IPPROTO_UDP,
+                                    reuseport=True)
+            selector.register(sock, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select(self.scheduler.timeout()):
+                if key.fileobj == self.worker_stop[0]:
+                    return
+                self.handle_udp(key.fileobj)
+            self.scheduler.send_due()
+
+    def _stop_workers(self):
+        if self.worker_stop is None:
+            return
+        for fd in self.worker_stop:
+            os.close(fd)
+        self.worker_stop = None
+        for proc in self.worker_procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+        self.worker_procs = []
 
     def _bind_sockets(self):
         """
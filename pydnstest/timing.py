@@ -0,0 +1,59 @@
+"""Timing of scenario steps and queries sent to the binary under test"""
+
+import contextlib
+import json
+import time
+from typing import Any, Dict, Iterator, List, Optional  # noqa
+
+
+class TimingRecorder:
+    """
+    Per-scenario record of played steps and queries they sent.
+
+    Timestamps are in seconds from time.monotonic(), RTTs in milliseconds.
+    """
+
+    def __init__(self) -> None:
+        self.steps = []  # type: List[Dict[str, Any]]
+        # UDP queries received by mocked servers, see record_server()
+        self.server = {}  # type: Dict[str, Any]
+
+    @contextlib.contextmanager
+    def record_step(self, step) -> Iterator[None]:
+        """ Record step played in the context, each play of a repeated step has its own record. """
+        record = {'id': step.id, 'type': step.type, 'start': time.monotonic(), 'end': None,
+                  'queries': []}  # type: Dict[str, Any]
+        self.steps.append(record)
+        try:
+            yield
+        finally:
+            record['end'] = time.monotonic()
+
+    def add_query(self, sent: float, received: Optional[float],
+                  bytes_sent: int, bytes_received: int) -> None:
+        """ Record query of the current step, received is None if no answer was expected. """
+        self.steps[-1]['queries'].append({
+            'sent': sent, 'received': received,
+            'rtt': (received - sent) * 1000 if received is not None else None,
+            'bytes_sent': bytes_sent, 'bytes_received': bytes_received})
+
+    def record_server(self, udp_queries: int, udp_batches: int) -> None:
+        """ Record UDP queries received by mocked servers and number of batches they came in. """
+        self.server = {'udp_queries': udp_queries, 'udp_batches': udp_batches,
+                       'mean_batch_size': udp_queries / udp_batches if udp_batches else None}
+
+    def summary(self) -> Dict[str, Any]:
+        """ Return number of answered queries and their mean and maximum RTT. """
+        rtts = [query['rtt'] for step in self.steps for query in step['queries']
+                if query['rtt'] is not None]
+        return {'queries': len(rtts),
+                'mean_rtt': sum(rtts) / len(rtts) if rtts else None,
+                'max_rtt': max(rtts, default=None)}
+
+    def to_json(self) -> str:
+        return json.dumps({'summary': self.summary(), 'server': self.server,
+                           'steps': self.steps}, indent=2)
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as timing_file:
+            timing_file.write(self.to_json())
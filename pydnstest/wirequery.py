@@ -0,0 +1,91 @@
+"""Lightweight view of DNS query in wire format used by the test server"""
+
+import struct
+from typing import Any, Dict  # noqa
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+HEADER = struct.Struct('!6H')
+QUESTION_TAIL = struct.Struct('!HH')
+OPT_TAIL = struct.Struct('!HHIH')
+
+
+class WireQuery:
+    """
+    Read-only view of DNS query in wire format.
+
+    Header, question and EDNS fields of a usual query (single question and optional OPT record)
+    are read directly from wire. Full dns.message.Message is parsed on first access
+    to any other attribute, e.g. options or sections of unusual queries.
+    """
+
+    def __init__(self, wire: bytes) -> None:
+        self.wire = wire
+        try:
+            fields = self.parse_usual_query(wire)
+        except (struct.error, dns.exception.DNSException, ValueError):
+            # Leave anything unusual (incl. malformed messages) to dnspython
+            self.message = dns.message.from_wire(wire, one_rr_per_rrset=True)
+        else:
+            self.__dict__.update(fields)
+
+    @staticmethod
+    def parse_usual_query(wire: bytes) -> Dict[str, Any]:
+        """
+        Read header, question and OPT record into dict of message attributes.
+
+        Raises ValueError for messages with other records or more than one question.
+        """
+        msg_id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(wire)
+        if qdcount > 1 or ancount or nscount or arcount > 1:
+            raise ValueError('not a usual query')
+        fields = {'id': msg_id, 'flags': flags, 'question': [], 'answer': [], 'authority': [],
+                  'additional': [], 'ednsflags': 0, 'payload': 0, 'edns': -1}
+        current = HEADER.size
+        if qdcount:
+            qname, used = dns.name.from_wire(wire, current)
+            current += used
+            qtype, qclass = QUESTION_TAIL.unpack_from(wire, current)
+            current += QUESTION_TAIL.size
+            fields['question'].append(dns.rrset.RRset(qname, qclass, qtype))
+        if arcount:
+            # OPT record: root owner name, type, payload, extended rcode and flags, options
+            if wire[current] != 0:
+                raise ValueError('additional record is not OPT')
+            rdtype, payload, ttl, rdlen = OPT_TAIL.unpack_from(wire, current + 1)
+            if rdtype != dns.rdatatype.OPT:
+                raise ValueError('additional record is not OPT')
+            current += 1 + OPT_TAIL.size + rdlen
+            fields.update(ednsflags=ttl, payload=payload, edns=(ttl & 0xFF0000) >> 16)
+        if current != len(wire):
+            raise ValueError('message is truncated or has trailing data')
+        return fields
+
+    def __getattr__(self, name):
+        if 'wire' not in self.__dict__:  # not initialized yet, e.g. copy.copy()
+            raise AttributeError(name)
+        if name == 'message':
+            self.message = dns.message.from_wire(self.wire, one_rr_per_rrset=True)
+            return self.message
+        return getattr(self.message, name)
+
+    def opcode(self) -> dns.opcode.Opcode:
+        return dns.opcode.from_flags(self.flags)
+
+    def rcode(self) -> dns.rcode.Rcode:
+        return dns.rcode.from_flags(self.flags, self.ednsflags)
+
+    def to_wire(self, *args, **kwargs) -> bytes:
+        return self.message.to_wire(*args, **kwargs)
+
+    def to_text(self, *args, **kwargs) -> str:
+        return self.message.to_text(*args, **kwargs)
+
+    def __str__(self) -> str:
+        return str(self.message)
@@ -5,8 +5,8 @@ import os
 import sys
 from typing import Any, Callable, Iterable, Iterator, Optional, List, Union, Set  # noqa
 
-import pydnstest.augwrap
 import pydnstest.matchpart
+import pydnstest.rplparser
 import pydnstest.scenario
 
 Element = Union["Entry", "Step", pydnstest.scenario.Range]
@@ -45,7 +45,7 @@ def is_empty(iterable: Iterator[Any]) -> bool:
 
 
 class Entry:
-    def __init__(self, node: pydnstest.augwrap.AugeasNode) -> None:
+    def __init__(self, node: pydnstest.rplparser.RplNode) -> None:
         self.match = {m.value for m in node.match("/match")}
         self.adjust = {a.value for a in node.match("/adjust")}
         self.answer = list(node.match("/section/answer/record"))
@@ -57,7 +57,7 @@ class Entry:
 
 
 class Step:
-    def __init__(self, node: pydnstest.augwrap.AugeasNode) -> None:
+    def __init__(self, node: pydnstest.rplparser.RplNode) -> None:
         self.node = node
         self.type = node["/type"].value
         try:
@@ -91,15 +91,12 @@ class RplintFail:
 
 class RplintTest:
     def __init__(self, path: str) -> None:
-        aug = pydnstest.augwrap.AugeasWrapper(confpath=os.path.realpath(path),
-                                              lens='Deckard',
-                                              loadpath=os.path.join(os.path.dirname(__file__),
-                                                                    'pydnstest'))
-        self.node = aug.tree
+        self.node = pydnstest.scenario.load_tree(os.path.realpath(path))
         self.name = os.path.basename(path)
         self.path = path
 
-        _, self.config = pydnstest.scenario.parse_file(os.path.realpath(path))
+        scenario, self.config = pydnstest.scenario.parse_tree(self.node)
+        scenario.materialize()  # report malformed records, messages are built on first use
         self.range_entries = [Entry(node) for node in self.node.match("/scenario/range/entry")]
         self.steps = [Step(node) for node in self.node.match("/scenario/step")]
         self.step_entries = [step.entry for step in self.steps if step.entry is not None]
@@ -295,11 +292,7 @@ def range_shadowing_match_rules(test: RplintTest) -> List[RplintFail]:
     fails = []
     for r in test.ranges:
         for e1, e2 in itertools.combinations(r.stored, 2):
-            try:
-                e1.match(e2.message)
-            except ValueError:
-                pass
-            else:
+            if e1.matches(e2.message):
                 info = f"previous entry on line {get_line_number(test.path, e1.node.char)}"
                 if e1.match_fields > e2.match_fields:
                     continue
@@ -312,7 +305,7 @@ def range_shadowing_match_rules(test: RplintTest) -> List[RplintFail]:
 def step_duplicate_id(test: RplintTest) -> List[RplintFail]:
     """STEP has the same ID as one of previous ones"""
     fails = []
-    step_numbers = set()  # type: Set[int]
+    step_numbers = set()  # type: Set[Optional[str]]
     for step in test.steps:
         if step.node.value in step_numbers:
             fails.append(RplintFail(test, step))
@@ -4,11 +4,18 @@ MAKEDIR="$(dirname "$0")"
 pytest_uncollected_ecode=5  # https://docs.pytest.org/en/stable/reference/exit-codes.html
 ci_skip_ecode=77            # https://mesonbuild.com/Unit-tests.html#skipped-tests-and-hard-errors
 
+# Daemons kept running between tests (DECKARD_WARM) require all tests to run in one process
+FORKED="--forked"
+if [[ "${DECKARD_WARM,,}" =~ ^(yes|true|on|1)$ ]]
+then
+    FORKED=""
+fi
+
 # Currently there no tests requiring faking monotonic time in this repository (there are some elsewhere)
 # pytest returns code 5 on "no tests were run" so we just ignore it
-faketime -m "" python3 -m pytest -c "${MAKEDIR}/deckard_pytest.ini" --tb=short -q ${VERBOSE:+"--log-level=DEBUG"} "${MAKEDIR}" ${DECKARDFLAGS:-} ${TESTS:+"--scenarios=${TESTS}"} -m "monotonic" --forked "$@"
+faketime -m "" python3 -m pytest -c "${MAKEDIR}/deckard_pytest.ini" --tb=short -q ${VERBOSE:+"--log-level=DEBUG"} "${MAKEDIR}" ${DECKARDFLAGS:-} ${TESTS:+"--scenarios=${TESTS}"} -m "monotonic" ${FORKED} "$@"
 MONO_RES=$?
-faketime -m --exclude-monotonic "" python3 -m pytest -c "${MAKEDIR}/deckard_pytest.ini" --tb=short -q ${VERBOSE:+"--log-level=DEBUG"} "${MAKEDIR}" ${DECKARDFLAGS:-} ${TESTS:+"--scenarios=${TESTS}"} -m "not monotonic" --forked "$@"
+faketime -m --exclude-monotonic "" python3 -m pytest -c "${MAKEDIR}/deckard_pytest.ini" --tb=short -q ${VERBOSE:+"--log-level=DEBUG"} "${MAKEDIR}" ${DECKARDFLAGS:-} ${TESTS:+"--scenarios=${TESTS}"} -m "not monotonic" ${FORKED} "$@"
 NONMONO_RES=$?
 
 if [ $MONO_RES -eq $pytest_uncollected_ecode -a $NONMONO_RES -eq $pytest_uncollected_ecode ]
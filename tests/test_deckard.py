@@ -1,9 +1,16 @@
 """ This is unittest file for parse methods in scenario.py """
 import os
 import shutil
+import socket
+import subprocess
+import sys
 import tempfile
 
-from deckard import create_trust_anchor_files
+import pytest
+
+import deckard
+from deckard import (conncheck_daemon, create_trust_anchor_files, daemons_key, listening,
+                     notify_socket, reset_daemon, start_order)
 
 
 def test_create_trust_anchor_files():
@@ -27,3 +34,107 @@ def test_create_trust_anchor_files():
                 assert ta_file.read() == ''.join(f'{ta}\n' for ta in trust_anchors[domain])
     finally:
         shutil.rmtree(tmpdir)
+
+
+def test_daemons_key():
+    """Daemons are reused only with the same arguments, configuration and trust anchors."""
+    program = {'name': 'kresd', 'binary': 'kresd', 'additional': ['-n']}
+    context = {'programs': [program], 'TRUST_ANCHOR_FILES': {}}
+    key = daemons_key(context, [[('config', 'net = { "127.127.0.2" }')]])
+    assert key == daemons_key(context, [[('config', 'net = { "127.127.0.2" }')]])
+    assert key != daemons_key(context, [[('config', 'net = { "127.127.0.3" }')]])
+    assert key != daemons_key(dict(context, TRUST_ANCHOR_FILES={'.': ['. DS 1']}),
+                              [[('config', 'net = { "127.127.0.2" }')]])
+
+
+def test_reset_daemon(tmp_path):
+    """Reset command runs in working directory and missing or failing command means restart."""
+    with subprocess.Popen(['sleep', '10']) as proc:
+        try:
+            cfg = {'name': 'test', 'WORKING_DIR': str(tmp_path),
+                   'reset': ['sh', '-c', 'echo $DECKARD_DAEMON_PID > pid']}
+            assert reset_daemon({'proc': proc, 'cfg': cfg})
+            assert (tmp_path / 'pid').read_text() == f'{proc.pid}\n'
+            cfg['reset'] = ['false']
+            assert not reset_daemon({'proc': proc, 'cfg': cfg})
+            del cfg['reset']
+            assert not reset_daemon({'proc': proc, 'cfg': cfg})
+        finally:
+            proc.kill()
+
+
+def test_render_template(tmp_path, monkeypatch):
+    """Templates are rendered again only if a variable used by them or included ones changes."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'main.j2').write_text('{{SELF_ADDR}} {% include "inc.j2" %}')
+    (tmp_path / 'inc.j2').write_text('{{QMIN}}')
+    assert deckard.template_variables(str(tmp_path), 'main.j2') == {'SELF_ADDR', 'QMIN'}
+    rendered = len(deckard.RENDERED_TEMPLATES)
+    assert deckard.render_template('main.j2', {'SELF_ADDR': '127.0.0.1', 'QMIN': True,
+                                               'tmpdir': '/tmp/a'}) == '127.0.0.1 True'
+    assert deckard.render_template('main.j2', {'SELF_ADDR': '127.0.0.1', 'QMIN': True,
+                                               'tmpdir': '/tmp/b'}) == '127.0.0.1 True'
+    assert len(deckard.RENDERED_TEMPLATES) == rendered + 1
+    assert deckard.render_template('main.j2', {'SELF_ADDR': '127.0.0.1', 'QMIN': False,
+                                               'tmpdir': '/tmp/b'}) == '127.0.0.1 False'
+
+
+def test_start_order():
+    """Programs are started after programs they depend on, cycles are rejected."""
+    programs = [{'name': 'forwarder', 'depends_on': ['recursor']},
+                {'name': 'recursor', 'depends_on': ['auth']},
+                {'name': 'auth'},
+                {'name': 'other'}]
+    assert [cfg['name'] for cfg in start_order(programs)] == \
+        ['auth', 'recursor', 'forwarder', 'other']
+    programs[2]['depends_on'] = ['forwarder']
+    with pytest.raises(ValueError, match='depend on each other'):
+        start_order(programs)
+    with pytest.raises(ValueError, match='unknown program'):
+        start_order([{'name': 'forwarder', 'depends_on': ['recursor']}])
+
+
+def test_listening():
+    """Listening socket is found in /proc/net/tcp."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        assert not listening('127.0.0.1', socket.AF_INET, port)
+        sock.listen()
+        assert listening('127.0.0.1', socket.AF_INET, port)
+        assert not listening('127.0.0.2', socket.AF_INET, port)
+
+
+@pytest.mark.skipif(not socket.has_ipv6, reason='IPv6 is not supported')
+@pytest.mark.parametrize('bind_address', ['::', '::ffff:127.0.0.1'])
+def test_listening__dual_stack(bind_address):
+    """IPv4 address is served by IPv6 socket listening on :: or on IPv4-mapped address."""
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.bind((bind_address, 0))
+        port = sock.getsockname()[1]
+        sock.listen()
+        assert listening('127.0.0.1', socket.AF_INET, port)
+        assert listening('::', socket.AF_INET6, port) == (bind_address == '::')
+
+
+def test_conncheck_daemon__notify(tmp_path):
+    """Daemon is ready when it sends READY=1, death of the daemon is detected."""
+    log = tmp_path / 'server.log'
+    log.write_text('')
+    cfg = {'name': 'test', 'WORKING_DIR': str(tmp_path), 'log': str(log), 'address': '127.0.0.1'}
+    notify = ('import os, socket, time; time.sleep(0.2); '
+              'socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM).sendto('
+              'b"STATUS=loaded\\nREADY=1", "\\0" + os.environ["NOTIFY_SOCKET"][1:])')
+    sock, address = notify_socket(cfg)
+    with sock:
+        cfg['args'] = [sys.executable, '-c', notify + '; time.sleep(10)']
+        with subprocess.Popen(cfg['args'], env=dict(os.environ, NOTIFY_SOCKET=address)) as proc:
+            try:
+                conncheck_daemon(proc, cfg, socket.AF_INET, sock)
+            finally:
+                proc.kill()
+        cfg['args'] = [sys.executable, '-c', 'raise SystemExit(3)']
+        with subprocess.Popen(cfg['args']) as proc:
+            with pytest.raises(subprocess.CalledProcessError, match='exit status 3'):
+                conncheck_daemon(proc, cfg, socket.AF_INET, sock)
@@ -11,11 +11,13 @@ def main():
     """Returns 0 if the test is parsed, 1 if not."""
     argparser = argparse.ArgumentParser()
     argparser.add_argument("file")
+    argparser.add_argument("--parser", choices=pydnstest.scenario.PARSERS,
+                           help="scenario parser (default: $DECKARD_PARSER or native)")
     args = argparser.parse_args()
-    if pydnstest.scenario.parse_file(os.path.realpath(args.file)):
-        sys.exit(0)
-    else:
-        sys.exit(1)
+    case, _ = pydnstest.scenario.parse_file(os.path.realpath(args.file), parser=args.parser)
+    # Messages are built on first use, build them all to report malformed records
+    case.materialize()
+    sys.exit(0)
 
 
 main()